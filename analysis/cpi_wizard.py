@@ -3,6 +3,10 @@ import numpy as np
 from pathlib import Path
 from datetime import datetime
 import os
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'dashboard'))
+from cpi_catalogue import CPICatalogue
 
 def calculate_mom_change(df, value_column='index', group_columns=None):
     if group_columns is None:
@@ -48,6 +52,9 @@ class CPIWizard:
         # item_code -> (division_name, group_name, class_name, item_name)
         self.item_map = self._build_item_map()
         
+        # Integer-coded items and nodes for resolving exclusions as masks
+        self.catalogue = CPICatalogue.from_directory(self.weights_path)
+        
         self.selected_exclusions = {
             'division': [],
             'group': [],
@@ -92,24 +99,13 @@ class CPIWizard:
         
         return res[['Item_Code', 'Item_Name', 'Division_Name', 'Group_Name', 'Class_Name', 'Weight']]
 
+    def _get_excluded_mask(self):
+        """Boolean mask over catalogue items excluded by the current selections"""
+        return self.catalogue.mask_for_names(self.selected_exclusions)
+
     def _get_excluded_item_codes(self):
         """Determine which item codes are excluded based on current selections"""
-        items_full = self.item_map
-        excluded = set()
-        
-        # Exclude by division name
-        excluded.update(items_full[items_full['Division_Name'].isin(self.selected_exclusions['division'])]['Item_Code'])
-        
-        # Exclude by group name
-        excluded.update(items_full[items_full['Group_Name'].isin(self.selected_exclusions['group'])]['Item_Code'])
-        
-        # Exclude by class name
-        excluded.update(items_full[items_full['Class_Name'].isin(self.selected_exclusions['class'])]['Item_Code'])
-        
-        # Exclude by item name
-        excluded.update(items_full[items_full['Item_Name'].isin(self.selected_exclusions['item'])]['Item_Code'])
-        
-        return excluded
+        return set(self.catalogue.item_codes[self._get_excluded_mask()])
 
     def run(self):
         print("\n" + "="*50)
@@ -168,9 +164,9 @@ class CPIWizard:
             print("\nNo indices were generated. Exiting.")
 
     def _show_current_status(self):
-        excluded_codes = self._get_excluded_item_codes()
-        total_weight = self.item_map['Weight'].sum()
-        excluded_weight = self.item_map[self.item_map['Item_Code'].isin(excluded_codes)]['Weight'].sum()
+        excluded_mask = self._get_excluded_mask()
+        total_weight = self.catalogue.item_weights.sum()
+        excluded_weight = self.catalogue.item_weights[excluded_mask].sum()
         
         print("\n" + "-"*40)
         print("CURRENT EXCLUSIONS:")
@@ -182,7 +178,7 @@ class CPIWizard:
         if not any_ex: print("  None")
         
         print(f"\nIMPACT SUMMARY:")
-        print(f"  Items Excluded: {len(excluded_codes)}")
+        print(f"  Items Excluded: {int(excluded_mask.sum())}")
         print(f"  Weight Removed: {excluded_weight:.2f}")
         print(f"  Weight Remaining: {(total_weight - excluded_weight):.2f}")
         print("-" * 40)
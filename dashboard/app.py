@@ -110,13 +110,31 @@ def create_hierarchy_ui(engine):
                     if not grp_include:
                         excluded_groups.append(grp_code)
                     
-                    # Show class count
+                    # Show classes, each one excludable
                     if grp_include and grp_data['classes']:
-                        class_count = len(grp_data['classes'])
-                        items_count = sum(c['item_count'] for c in grp_data['classes'].values())
-                        st.caption(f"└─ {class_count} classes, {items_count} items")
+                        for cls_code in sorted(grp_data['classes'].keys()):
+                            cls_data = grp_data['classes'][cls_code]
+                            cls_include = st.checkbox(
+                                f"└─ {cls_data['name']} ({cls_data['weight']:.2f}%, {cls_data['item_count']} items)",
+                                value=True,
+                                key=f"cls_{grp_code}_{cls_code}"
+                            )
+                            
+                            if not cls_include:
+                                excluded_classes.append(cls_code)
     
-    return excluded_divisions, excluded_groups, excluded_classes
+    item_labels = {
+        f"{name} ({code})": code
+        for code, name in zip(engine.items_df['Item_Code'], engine.items_df['Item_Name'])
+    }
+    excluded_item_labels = st.sidebar.multiselect(
+        "Exclude individual items",
+        options=list(item_labels.keys()),
+        key="excluded_items"
+    )
+    excluded_items = [item_labels[label] for label in excluded_item_labels]
+    
+    return excluded_divisions, excluded_groups, excluded_classes, excluded_items
 
 def display_metrics(headline, current):
     """Display comparison metrics"""
@@ -135,16 +153,14 @@ def display_metrics(headline, current):
         st.metric("⚖️ Weight", f"{current_weight:.2f}", f"-{excluded_pct:.2f}% excluded")
     
     with col3:
-        headline_idx = headline['Monthly_Data'][-1]['Index'] if headline['Monthly_Data'] else 100
-        current_idx = current['Monthly_Data'][-1]['Index'] if current['Monthly_Data'] else 100
+        headline_idx = headline.index[-1] if len(headline.index) else 100
+        current_idx = current.index[-1] if len(current.index) else 100
         diff = current_idx - headline_idx
         st.metric("📈 Latest Index", f"{current_idx:.2f}", f"{diff:+.2f} vs Headline")
     
     with col4:
-        if len(current['Monthly_Data']) > 1:
-            curr_idx = current['Monthly_Data'][-1]['Index']
-            prev_idx = current['Monthly_Data'][-2]['Index']
-            mom_change = ((curr_idx - prev_idx) / prev_idx) * 100
+        if len(current.index) > 1:
+            mom_change = current.mom[-1]
             st.metric("📊 MoM Change", f"{mom_change:+.3f}%")
 
 def display_comparison_chart(headline, current):
@@ -152,8 +168,8 @@ def display_comparison_chart(headline, current):
     if not headline or not current:
         return
     
-    headline_data = pd.DataFrame(headline['Monthly_Data'])
-    current_data = pd.DataFrame(current['Monthly_Data'])
+    headline_data = headline.to_frame()
+    current_data = current.to_frame()
     
     fig = go.Figure()
     
@@ -196,24 +212,19 @@ def display_comparison_table(headline, current):
     if not headline or not current:
         return
     
-    comparison_data = []
+    # Align on months present in both series, then compare as arrays
+    months, headline_idx, current_idx = headline.aligned(current)
+    diff = current_idx - headline_idx
+    with np.errstate(divide='ignore', invalid='ignore'):
+        diff_pct = np.where(headline_idx != 0, diff / headline_idx * 100, 0.0)
     
-    for i, headline_month in enumerate(headline['Monthly_Data']):
-        if i < len(current['Monthly_Data']):
-            current_month = current['Monthly_Data'][i]
-            
-            headline_idx = headline_month['Index']
-            current_idx = current_month['Index']
-            diff = current_idx - headline_idx
-            diff_pct = (diff / headline_idx * 100) if headline_idx != 0 else 0
-            
-            comparison_data.append({
-                'Month': headline_month['Month'],
-                'Headline': round(headline_idx, 2),
-                'Current': round(current_idx, 2),
-                'Difference': round(diff, 2),
-                'Diff %': round(diff_pct, 3)
-            })
+    comparison_data = {
+        'Month': months,
+        'Headline': np.round(headline_idx, 2),
+        'Current': np.round(current_idx, 2),
+        'Difference': np.round(diff, 2),
+        'Diff %': np.round(diff_pct, 3)
+    }
     
     df = pd.DataFrame(comparison_data)
     st.dataframe(df, use_container_width=True, hide_index=True)
@@ -117,11 +117,29 @@ def create_hierarchy_ui(engine):
                         excluded_groups.append(grp_code)
                     
                     if grp_include and grp_data['classes']:
-                        class_count = len(grp_data['classes'])
-                        items_count = sum(c['item_count'] for c in grp_data['classes'].values())
-                        st.caption(f"└─ {class_count} classes, {items_count} items")
+                        for cls_code in sorted(grp_data['classes'].keys()):
+                            cls_data = grp_data['classes'][cls_code]
+                            cls_include = st.checkbox(
+                                f"└─ {cls_data['name']} ({cls_data['weight']:.2f}%, {cls_data['item_count']} items)",
+                                value=True,
+                                key=f"cls_{grp_code}_{cls_code}"
+                            )
+                            
+                            if not cls_include:
+                                excluded_classes.append(cls_code)
+    
+    item_labels = {
+        f"{name} ({code})": code
+        for code, name in zip(engine.items_df['Item_Code'], engine.items_df['Item_Name'])
+    }
+    excluded_item_labels = st.sidebar.multiselect(
+        "Exclude individual items",
+        options=list(item_labels.keys()),
+        key="excluded_items"
+    )
+    excluded_items = [item_labels[label] for label in excluded_item_labels]
     
-    return excluded_divisions, excluded_groups, excluded_classes
+    return excluded_divisions, excluded_groups, excluded_classes, excluded_items
 
 # =============================================================================
 # TAB 2: MANUAL EXCLUSIONS FUNCTIONS
@@ -520,7 +538,7 @@ def main():
         st.markdown("Select categories from the sidebar to exclude from headline CPI")
         st.markdown("*Note: This method uses the actual CPI data loaded from the system*")
         
-        excluded_divisions, excluded_groups, excluded_classes = create_hierarchy_ui(engine)
+        excluded_divisions, excluded_groups, excluded_classes, excluded_items = create_hierarchy_ui(engine)
         
         st.sidebar.markdown("---")
         st.sidebar.markdown("## ⚡ Actions")
@@ -532,12 +550,13 @@ def main():
         if reset_btn:
             st.rerun()
         
-        if calc_btn or (excluded_divisions or excluded_groups):
+        if calc_btn or (excluded_divisions or excluded_groups or excluded_classes or excluded_items):
             # Use existing engine method for category-based exclusions
             result = engine.get_index_with_exclusions(
                 excluded_divisions=excluded_divisions,
                 excluded_groups=excluded_groups,
-                excluded_classes=excluded_classes
+                excluded_classes=excluded_classes,
+                excluded_items=excluded_items
             )
             
             if result:
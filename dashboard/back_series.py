@@ -0,0 +1,242 @@
+"""
+CPI Back Series
+Chain-links old-base (2012) index series onto the 2024 base
+"""
+
+import hashlib
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from typing import List, Tuple
+
+from price_store import detect_month_columns, read_cached_table
+
+
+# Sheet of the back-series workbook holding the old-base indices
+OLD_SERIES_SHEET = 'Index 2013 to 2025'
+
+SECTORS = ['Rural', 'Urban', 'Combined']
+
+# Key columns identifying one index series
+SERIES_KEYS = ['State', 'Sector', 'Series']
+
+# Series name of the all-items index, as the back-series workbook writes it
+GENERAL_INDEX = 'General Index (All Groups)'
+
+LINK_METHODS = ['annual', 'overlap']
+
+
+def _parse_back_series(source: Path) -> pd.DataFrame:
+    """
+    Old-base sheet as one row per state, sector and series, one column per month
+    
+    The sheet has one row per month with Rural, Urban and Combined columns
+    (its second header row holds the column names). Linked columns the
+    workbook computes with formulas are ignored.
+    """
+    raw = pd.read_excel(source, sheet_name=OLD_SERIES_SHEET, header=1)
+    raw = raw.dropna(subset=['Year', 'Month'])
+    month_numbers = pd.to_datetime(raw['Month'].astype(str).str.strip(), format='%B').dt.month
+    raw = raw.assign(
+        Label=[f"{int(year)}-{month:02d}" for year, month in zip(raw['Year'], month_numbers)],
+        State=raw['State'].astype(str).str.strip(),
+        Series=raw['Description'].astype(str).str.strip(),
+    )
+    
+    long = raw.melt(id_vars=['State', 'Series', 'Label'], value_vars=SECTORS,
+                    var_name='Sector', value_name='Index')
+    long['Index'] = pd.to_numeric(long['Index'], errors='coerce')
+    wide = long.pivot_table(index=SERIES_KEYS, columns='Label', values='Index', aggfunc='first')
+    return wide[detect_month_columns(wide.columns)].reset_index()
+
+
+def published_series(published: pd.DataFrame) -> pd.DataFrame:
+    """
+    Series in the linker's long layout from a published CPI table
+    
+    Args:
+        published: Rows with state, sector, year, month (name), code and
+            index columns, plus the division ... item name columns
+            (e.g. analysis/scraped_cpi.csv). The general index ('*') is
+            named GENERAL_INDEX; other rows take their deepest name.
+    
+    Returns:
+        DataFrame with columns State, Sector, Series, Month ('YYYY-MM') and Index
+    """
+    frame = published.copy()
+    name_columns = [col for col in ['division', 'group', 'class', 'sub_class', 'item'] if col in frame.columns]
+    names = frame[name_columns].astype(str).where(frame[name_columns].astype(str).ne('*'))
+    series = names.ffill(axis=1).iloc[:, -1]
+    series = series.where(frame['code'].astype(str).str.strip().ne('*'), GENERAL_INDEX)
+    
+    month_numbers = pd.to_datetime(frame['month'].astype(str).str.strip(), format='%B').dt.month
+    return pd.DataFrame({
+        'State': frame['state'].astype(str).str.strip(),
+        'Sector': frame['sector'].astype(str).str.strip(),
+        'Series': series.astype(str).str.strip(),
+        'Month': [f"{int(year)}-{month:02d}" for year, month in zip(frame['year'], month_numbers)],
+        'Index': pd.to_numeric(frame['index'], errors='coerce'),
+    }).drop_duplicates(subset=SERIES_KEYS + ['Month'])
+
+
+class BackSeriesLinker:
+    """
+    Links old-base series to new-base series over their overlap
+    
+    The old series are held as a (series, months) array. link() aligns the
+    new series to it, computes one linking factor per series from the
+    overlap months and rescales every old series with a single broadcast
+    multiply. Linked panels are cached per new-series content, method and
+    overlap.
+    """
+    
+    def __init__(self, old_frame: pd.DataFrame):
+        """
+        Args:
+            old_frame: One row per series: State, Sector, Series and one
+                column per month ('YYYY-MM')
+        """
+        self.months = detect_month_columns(old_frame.columns)
+        self.keys = old_frame[SERIES_KEYS].astype(str).reset_index(drop=True)
+        self.values = old_frame[self.months].to_numpy(dtype=float)
+        self._rows = {self._match_key(key): row for row, key in enumerate(self.keys.itertuples(index=False))}
+        self._linked = {}
+    
+    @classmethod
+    def from_workbook(cls, source: Path, use_cache: bool = True) -> 'BackSeriesLinker':
+        """Linker over the old-base sheet of the back-series workbook"""
+        old_frame, _ = read_cached_table(source, _parse_back_series, tag='back_series', use_cache=use_cache)
+        return cls(old_frame)
+    
+    @staticmethod
+    def _match_key(key) -> Tuple[str, ...]:
+        # The workbook writes 'ALL India' where published tables have 'All India'
+        return tuple(str(part).strip().casefold() for part in key)
+    
+    # =========================================================================
+    # LINKING
+    # =========================================================================
+    
+    def _align(self, new: pd.DataFrame) -> Tuple[pd.DataFrame, List[str], np.ndarray, np.ndarray]:
+        """New series as an array, plus each one's old-series row (-1 if none)"""
+        wide = new.pivot_table(index=SERIES_KEYS, columns='Month', values='Index', aggfunc='first')
+        months = detect_month_columns(wide.columns)
+        keys = wide.index.to_frame(index=False).astype(str)
+        rows = np.array([self._rows.get(self._match_key(key), -1) for key in keys.itertuples(index=False)], dtype=int)
+        return keys, months, wide[months].to_numpy(dtype=float), rows
+    
+    def _overlap_columns(self, new_months: List[str], method: str, overlap: str = None) -> List[str]:
+        """Months used to link: one month, or the months of one year"""
+        common = [month for month in self.months if month in set(new_months)]
+        if not common:
+            raise Exception("Old and new series have no months in common")
+        
+        if method == 'overlap':
+            overlap = overlap or common[0]
+            if overlap not in common:
+                raise Exception(f"Overlap month {overlap} is not in both series")
+            return [overlap]
+        
+        year = str(overlap or common[0][:4])
+        months = [month for month in common if month.startswith(year + '-')]
+        if not months:
+            raise Exception(f"No overlap months in {year}")
+        return months
+    
+    def linking_factors(self, new: pd.DataFrame, method: str = 'annual', overlap: str = None,
+                        decimals: int = None) -> pd.DataFrame:
+        """
+        Linking factor of every series present in both bases
+        
+        Args:
+            new: New-base series with columns State, Sector, Series, Month
+                and Index (see published_series)
+            method: 'annual' (ratio of geometric means over the overlap year,
+                as in the official linking) or 'overlap' (ratio in one month)
+            overlap: Year ('YYYY') for 'annual' or month ('YYYY-MM') for
+                'overlap'; default the first common year or month
+            decimals: Round factors, e.g. 4 to match the published factors
+        
+        Returns:
+            DataFrame with State, Sector, Series and Factor
+        """
+        keys, _, factors, _ = self._link_arrays(new, method, overlap, decimals)
+        return keys.assign(Factor=factors)
+    
+    def _link_arrays(self, new: pd.DataFrame, method: str, overlap: str, decimals: int):
+        if method not in LINK_METHODS:
+            raise Exception(f"Unknown linking method: {method}")
+        
+        keys, new_months, new_values, rows = self._align(new)
+        matched = rows >= 0
+        keys, new_values, rows = keys[matched].reset_index(drop=True), new_values[matched], rows[matched]
+        
+        columns = self._overlap_columns(new_months, method, overlap)
+        old_overlap = self.values[np.ix_(rows, [self.months.index(month) for month in columns])]
+        new_overlap = new_values[:, [new_months.index(month) for month in columns]]
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Geometric mean of a single month is that month, so one formula covers both methods
+            factors = np.exp(np.log(new_overlap).mean(axis=1) - np.log(old_overlap).mean(axis=1))
+        if decimals is not None:
+            factors = np.round(factors, decimals)
+        return keys, (new_months, new_values), factors, rows
+    
+    def link(self, new: pd.DataFrame, method: str = 'annual', overlap: str = None,
+             decimals: int = None) -> pd.DataFrame:
+        """
+        Continuous new-base series for every state, sector and series
+        
+        Months before the first new-base month come from the old series
+        times its linking factor; from then on the new series is used as
+        published. Series missing from either base are left out.
+        
+        Args:
+            new, method, overlap, decimals: As for linking_factors
+        
+        Returns:
+            Tidy DataFrame with State, Sector, Series, Month, Index, Source
+            ('linked' or 'current') and Factor
+        """
+        content = pd.util.hash_pandas_object(new[SERIES_KEYS + ['Month', 'Index']], index=False)
+        cache_key = (hashlib.sha256(content.to_numpy().tobytes()).hexdigest(), method, overlap, decimals)
+        if cache_key in self._linked:
+            return self._linked[cache_key].copy()
+        
+        keys, (new_months, new_values), factors, rows = self._link_arrays(new, method, overlap, decimals)
+        
+        back_months = [month for month in self.months if month < new_months[0]]
+        linked = self.values[rows][:, :len(back_months)] * factors[:, None]
+        panel = np.concatenate([linked, new_values], axis=1)
+        months = back_months + new_months
+        
+        n_series, n_months = panel.shape
+        frame = pd.DataFrame({
+            **{col: np.repeat(keys[col].to_numpy(), n_months) for col in SERIES_KEYS},
+            'Month': np.tile(months, n_series),
+            'Index': panel.ravel(),
+            'Source': np.tile(['linked'] * len(back_months) + ['current'] * len(new_months), n_series),
+            'Factor': np.repeat(factors, n_months),
+        }).dropna(subset=['Index']).reset_index(drop=True)
+        
+        self._linked[cache_key] = frame
+        return frame.copy()
+    
+    def rebase(self, linked: pd.DataFrame, base: str) -> pd.DataFrame:
+        """
+        Re-express linked series with a new reference period = 100
+        
+        Args:
+            linked: Output of link()
+            base: Base year ('YYYY', its monthly average = 100) or month ('YYYY-MM')
+        
+        Returns:
+            Copy of linked with Index rescaled per series
+        """
+        in_base = linked['Month'].str.startswith(base) if len(base) == 4 else linked['Month'].eq(base)
+        base_level = linked[in_base].groupby(SERIES_KEYS)['Index'].mean()
+        if base_level.empty:
+            raise Exception(f"No linked data in base period {base}")
+        
+        levels = linked.join(base_level.rename('Base_Level'), on=SERIES_KEYS)['Base_Level']
+        return linked.assign(Index=linked['Index'] / levels * 100).dropna(subset=['Index'])
@@ -0,0 +1,330 @@
+"""
+CPI Item Catalogue
+Dense integer IDs for items and hierarchy nodes, with per-node item masks
+"""
+
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from pathlib import Path
+from typing import List, Dict, Iterable, Tuple
+
+
+# Hierarchy levels above items, outermost first
+HIERARCHY_LEVELS = ['division', 'group', 'class', 'subclass']
+
+# Name column of each level's weight table
+NAME_COLUMNS = {
+    'division': 'Division_Name',
+    'group': 'Group_Name',
+    'class': 'Class_Name',
+    'subclass': 'Subclass_Name',
+    'item': 'Item_Name',
+}
+
+
+def clean_codes(series: pd.Series) -> np.ndarray:
+    """Hierarchy codes as stripped strings (float codes such as 1.1 become '1.1')"""
+    return np.array([str(code).strip() for code in series.tolist()], dtype=object)
+
+
+class CPICatalogue:
+    """
+    Integer-coded view of the CPI weight hierarchy
+    
+    Items keep their items_df row position as ID. Every division, group,
+    class and subclass gets a node ID; node membership is held only as
+    sparse nodes x items CSR matrices of ones (node_membership) and item
+    weights (node_incidence), built straight from each item's node path,
+    so one sparse product aggregates every level. An exclusion set is the
+    OR of its nodes' CSR rows (nodes_mask), mask_cover() splits any item
+    mask back into whole nodes plus single items, and mask_key() packs any
+    item mask into a compact hashable bitset key.
+    """
+    
+    def __init__(self, items_df: pd.DataFrame, subclasses_df: pd.DataFrame,
+                 classes_df: pd.DataFrame, groups_df: pd.DataFrame,
+                 divisions_df: pd.DataFrame):
+        """Index the five weight tables"""
+        self.items_df = items_df
+        self.subclasses_df = subclasses_df
+        self.classes_df = classes_df
+        self.groups_df = groups_df
+        self.divisions_df = divisions_df
+        
+        self.item_codes = items_df['Item_Code'].to_numpy()
+        self.item_weights = items_df['Weight'].to_numpy(dtype=float)
+        
+        # Only item_ids (code lookup) and item_paths (path table) are built on
+        # first use; the item path arrays and node index below are built here
+        self._item_ids = None
+        self._item_paths = None
+        self.parent_codes = None
+        self.node_keys = None
+        self.node_ids = None
+        self.node_parents = None
+        self.node_names = None
+        self.node_sizes = None
+        self.node_membership = None
+        self.node_incidence = None
+        self.item_node_ids = None
+        self._item_subclass_rows = None
+        self._subclass_paths = None
+        
+        self._build_item_paths()
+        self._build_node_index()
+    
+    @classmethod
+    def from_directory(cls, weights_dir: Path) -> 'CPICatalogue':
+        """Build a catalogue from the CSV files in a weights directory"""
+        weights_dir = Path(weights_dir)
+        return cls(
+            pd.read_csv(weights_dir / 'items.csv'),
+            pd.read_csv(weights_dir / 'subclasses.csv'),
+            pd.read_csv(weights_dir / 'classes.csv'),
+            pd.read_csv(weights_dir / 'groups.csv'),
+            pd.read_csv(weights_dir / 'divisions.csv'),
+        )
+    
+    @property
+    def n_items(self) -> int:
+        return len(self.item_codes)
+    
+    @property
+    def n_nodes(self) -> int:
+        return len(self.node_keys)
+    
+    @property
+    def item_ids(self) -> Dict[str, int]:
+        """Item code -> item ID"""
+        if self._item_ids is None:
+            self._item_ids = dict(zip(self.item_codes.tolist(), range(self.n_items)))
+        return self._item_ids
+    
+    @property
+    def item_paths(self) -> pd.DataFrame:
+        """Each item's division, group, class and subclass codes (one row per item, in items_df order)"""
+        if self._item_paths is None:
+            item_path_array = self._subclass_paths[self._item_subclass_rows]
+            self._item_paths = pd.DataFrame({
+                'Item_Code': self.item_codes,
+                **{level: item_path_array[:, depth] for depth, level in enumerate(HIERARCHY_LEVELS)}
+            })
+        return self._item_paths
+    
+    def _build_item_paths(self):
+        """
+        Resolve each item's subclass, class, group and division codes
+        
+        Sets the per-subclass paths behind item_paths and parent_codes, a flat
+        child code -> parent code Series for subclasses, classes and groups.
+        Parents are looked up once per distinct subclass, then fanned out to items.
+        """
+        links = {
+            'subclass': (self.subclasses_df['Subclass_Code'], self.subclasses_df['Class_Code']),
+            'class': (self.classes_df['Class_Code'], self.classes_df['Group_Code']),
+            'group': (self.groups_df['Group_Code'], self.groups_df['Division_Code']),
+        }
+        self.parent_codes = {}
+        for level, (child, parent) in links.items():
+            link = pd.Series(clean_codes(parent), index=clean_codes(child))
+            self.parent_codes[level] = link[~link.index.duplicated()]
+        
+        class_of, group_of, division_of = (
+            dict(zip(self.parent_codes[level].index, self.parent_codes[level].to_numpy()))
+            for level in ('subclass', 'class', 'group')
+        )
+        known_divisions = set(clean_codes(self.divisions_df['Division_Code']))
+        
+        subclass_rows, subclasses = pd.factorize(self.items_df['Subclass_Code'])
+        unique_paths = []
+        for subclass in subclasses:
+            subclass = str(subclass).strip()
+            cls = class_of.get(subclass)
+            grp = group_of.get(cls)
+            div = division_of.get(grp)
+            # Only items with a complete path up to a known division sit in the hierarchy
+            if div in known_divisions:
+                unique_paths.append((div, grp, cls, subclass))
+            else:
+                unique_paths.append((None,) * len(HIERARCHY_LEVELS))
+        
+        # Trailing empty path so items without a subclass (row -1) get no path
+        unique_paths.append((None,) * len(HIERARCHY_LEVELS))
+        path_array = np.array(unique_paths, dtype=object).reshape(-1, len(HIERARCHY_LEVELS))
+        
+        self._item_subclass_rows = subclass_rows
+        self._subclass_paths = path_array
+    
+    def _build_node_index(self):
+        """Assign node IDs to every division, group, class and subclass"""
+        # Node IDs are assigned per distinct subclass path, in order of first item
+        keys, parents, path_ids = [], [], []
+        for depth, level in enumerate(HIERARCHY_LEVELS):
+            level_rows, level_codes = pd.factorize(self._subclass_paths[:, depth])
+            offset = len(keys)
+            keys.extend((level, code) for code in level_codes)
+            
+            # Parent of each node, read off the node's first subclass path
+            first_path = np.zeros(len(level_codes), dtype=int)
+            in_level = np.flatnonzero(level_rows >= 0)[::-1]
+            first_path[level_rows[in_level]] = in_level
+            parents.extend(path_ids[-1][first_path] if depth else np.full(len(level_codes), -1))
+            
+            path_ids.append(np.where(level_rows >= 0, level_rows + offset, -1))
+        
+        item_node_ids = np.array(path_ids).reshape(len(HIERARCHY_LEVELS), -1)[:, self._item_subclass_rows]
+        
+        # Each item's path is one CSC column (paths are complete or empty); scipy's
+        # conversion then regroups the entries by node
+        in_hierarchy = item_node_ids[0] >= 0
+        rows = item_node_ids[:, in_hierarchy].T.ravel()
+        indptr = np.r_[0, np.cumsum(in_hierarchy * len(HIERARCHY_LEVELS))]
+        shape = (len(keys), self.n_items)
+        membership = sparse.csc_matrix((np.ones(len(rows)), rows, indptr), shape=shape).tocsr()
+        
+        self.node_keys = keys
+        self.node_ids = {key: node_id for node_id, key in enumerate(keys)}
+        self.node_parents = np.asarray(parents, dtype=int)
+        self.node_sizes = np.diff(membership.indptr)
+        self.node_membership = membership
+        self.node_incidence = sparse.csr_matrix(
+            (self.item_weights[membership.indices], membership.indices, membership.indptr), shape=shape
+        )
+        self.item_node_ids = item_node_ids
+        self.node_names = self._build_node_names()
+    
+    # =========================================================================
+    # LOOKUPS
+    # =========================================================================
+    
+    def item_mask(self, item_codes: Iterable[str]) -> np.ndarray:
+        """Boolean mask over items for the given item codes (unknown codes ignored)"""
+        mask = np.zeros(self.n_items, dtype=bool)
+        mask[[self.item_ids[code] for code in item_codes if code in self.item_ids]] = True
+        return mask
+    
+    def nodes_for_codes(self, divisions: List[str] = None, groups: List[str] = None,
+                        classes: List[str] = None, subclasses: List[str] = None) -> List[int]:
+        """Node IDs for codes given per level (unknown codes ignored)"""
+        selections = zip(HIERARCHY_LEVELS, [divisions, groups, classes, subclasses])
+        return sorted({
+            self.node_ids[(level, code)]
+            for level, level_codes in selections
+            for code in (level_codes or [])
+            if (level, code) in self.node_ids
+        })
+    
+    def nodes_for_published_codes(self, codes: Iterable[str]) -> np.ndarray:
+        """
+        Node IDs for codes as printed in published CPI tables (-1 if unknown)
+        
+        Published tables write divisions and groups as '01' and '01.1', where
+        the weight files have '1.0' and '1.1'; class and subclass codes match.
+        Item codes and the general index ('*') get -1.
+        """
+        levels = dict(enumerate(HIERARCHY_LEVELS))
+        node_ids = []
+        for code in codes:
+            code = str(code).strip()
+            level = levels.get(code.count('.'))
+            if level in ('division', 'group'):
+                try:
+                    code = str(float(code))
+                except ValueError:
+                    level = None
+            node_ids.append(self.node_ids.get((level, code), -1))
+        return np.asarray(node_ids, dtype=int)
+    
+    def nodes_for_names(self, level: str, names: Iterable[str]) -> List[int]:
+        """Node IDs at a level whose name is in names"""
+        names = set(names)
+        return [node_id for node_id in self._node_ids_by_level(level)
+                if self.node_names[node_id] in names]
+    
+    def items_for_names(self, names: Iterable[str]) -> np.ndarray:
+        """Boolean item mask for items whose name is in names"""
+        return self.items_df['Item_Name'].isin(set(names)).to_numpy()
+    
+    def _build_node_names(self) -> List[str]:
+        """Names for all nodes, aligned with node_keys"""
+        tables = {
+            'division': (self.divisions_df, 'Division_Code'),
+            'group': (self.groups_df, 'Group_Code'),
+            'class': (self.classes_df, 'Class_Code'),
+            'subclass': (self.subclasses_df, 'Subclass_Code'),
+        }
+        lookups = {}
+        for level, (table, code_column) in tables.items():
+            # Reversed so the first row of a duplicated code wins
+            pairs = zip(clean_codes(table[code_column])[::-1], table[NAME_COLUMNS[level]].tolist()[::-1])
+            lookups[level] = dict(pairs)
+        return [lookups[level].get(code) for level, code in self.node_keys]
+    
+    def _node_ids_by_level(self, level: str) -> List[int]:
+        """Node IDs of one level, in ID order"""
+        return [node_id for node_id, (node_level, _) in enumerate(self.node_keys) if node_level == level]
+    
+    # =========================================================================
+    # MASKS
+    # =========================================================================
+    
+    def nodes_mask(self, node_ids: Iterable[int]) -> np.ndarray:
+        """OR of the item masks of the given nodes (read off their CSR rows)"""
+        mask = np.zeros(self.n_items, dtype=bool)
+        node_ids = np.asarray(list(node_ids), dtype=int)
+        if len(node_ids):
+            mask[self.node_membership[node_ids].indices] = True
+        return mask
+    
+    def mask_for_codes(self, selections: Dict[str, List[str]]) -> np.ndarray:
+        """
+        Item mask for code-based selections
+        
+        Args:
+            selections: Mapping of level ('division', 'group', 'class',
+                'subclass' or 'item') to a list of codes (unknown codes ignored)
+        """
+        selections = selections or {}
+        node_ids = self.nodes_for_codes(*(selections.get(level) for level in HIERARCHY_LEVELS))
+        return self.item_mask(selections.get('item') or []) | self.nodes_mask(node_ids)
+    
+    def mask_cover(self, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Fewest whole nodes plus single items that make up an item mask
+        
+        Nodes whose items are all in the mask are kept when their parent is
+        not; items of the mask outside those nodes are listed one by one. The
+        parts are disjoint, so their partial sums add up to the mask's.
+        
+        Returns:
+            Tuple of (node IDs, item IDs)
+        """
+        inside = (self.node_membership @ mask.astype(float) == self.node_sizes) & (self.node_sizes > 0)
+        parent_inside = np.where(self.node_parents >= 0, inside[np.maximum(self.node_parents, 0)], False)
+        node_ids = np.flatnonzero(inside & ~parent_inside)
+        item_ids = np.flatnonzero(mask & ~self.nodes_mask(node_ids))
+        return node_ids, item_ids
+    
+    def mask_for_names(self, selections: Dict[str, List[str]]) -> np.ndarray:
+        """
+        Item mask for name-based selections
+        
+        Args:
+            selections: Mapping of level ('division', 'group', 'class',
+                'subclass' or 'item') to a list of names
+        """
+        mask = np.zeros(self.n_items, dtype=bool)
+        for level, names in selections.items():
+            if not names:
+                continue
+            if level == 'item':
+                mask |= self.items_for_names(names)
+            else:
+                mask |= self.nodes_mask(self.nodes_for_names(level, names))
+        return mask
+    
+    @staticmethod
+    def mask_key(mask: np.ndarray) -> bytes:
+        """Compact hashable key for an item mask (packed bitset)"""
+        return np.packbits(mask).tobytes()
@@ -3,16 +3,451 @@ CPI Index Calculator Engine
 Handles Laspeyres calculation with dynamic exclusions
 """
 
+import itertools
+import threading
+import warnings
+from collections import OrderedDict
+
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Callable, Hashable
+
+from cpi_catalogue import HIERARCHY_LEVELS, CPICatalogue, clean_codes
+from cpi_results import PERIOD_MEASURES, CPIResult, CPIBatchResult
+from price_imputation import impute_prices, imputation_counts
+from price_store import MONTH_PATTERN, PriceTensorStore, month_label, normalize_month_columns, read_price_table
+
+
+# Calendar months the period measures reach back (YoY lag, rolling window)
+MEASURE_LOOKBACK = 12
+
+# Spare price-matrix columns reserved at load, so a year of appends never copies the matrix
+APPEND_HEADROOM = 12
+
+# Keyword argument of get_index_with_exclusions / scenarios for each level
+EXCLUSION_ARGUMENTS = {
+    'division': 'excluded_divisions',
+    'group': 'excluded_groups',
+    'class': 'excluded_classes',
+    'subclass': 'excluded_subclasses',
+    'item': 'excluded_items',
+}
+
+
+def _laspeyres_kernel(values: np.ndarray, available: np.ndarray,
+                      masks: np.ndarray, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized Laspeyres index and MoM change for a stack of item selections
+    
+    Args:
+        values: (..., N, T) price relatives with missing cells set to 0
+        available: (..., N, T) 1.0 where a price exists, else 0.0
+        masks: (S, N) boolean item selection per scenario
+        weights: (N,) or (..., S, N) item weights
+    
+    Returns:
+        index and MoM arrays of shape (..., S, T). Months where no selected
+        item has a price are NaN in both, matching the skipped months of the
+        per-month loop; MoM is taken against the previous month with data.
+    """
+    selected = masks.astype(float)
+    scenario_weights = selected * weights
+    
+    return _index_from_sums(
+        scenario_weights @ values, scenario_weights @ available, selected @ available
+    )
+
+
+def _index_from_sums(weighted_sum: np.ndarray, weight_total: np.ndarray,
+                     price_count: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Turn per-month sums of weight x price, weight and priced-item count into
+    index and MoM arrays (see _laspeyres_kernel for the conventions)
+    """
+    matched = price_count > 0
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = np.where(weight_total > 0, weighted_sum / weight_total * 100, 100.0)
+    index = np.where(matched, index, np.nan)
+    
+    # Previous month with data, by forward-filling positions of matched months
+    positions = np.where(matched, np.arange(matched.shape[-1]), -1)
+    last_seen = np.maximum.accumulate(positions, axis=-1)
+    prev_pos = np.concatenate(
+        [np.full(last_seen.shape[:-1] + (1,), -1), last_seen[..., :-1]], axis=-1
+    )
+    prev_index = np.take_along_axis(index, np.maximum(prev_pos, 0), axis=-1)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mom = np.where(prev_pos >= 0, (index - prev_index) / prev_index * 100, 0.0)
+    mom = np.where(matched, mom, np.nan)
+    
+    return index, mom
+
+
+def _month_ordinal(month) -> int:
+    """Months since year 0 for a YYYY-MM (or date) label, None if it is not a month"""
+    match = MONTH_PATTERN.search(month_label(month))
+    if not match:
+        return None
+    return int(match.group(1)) * 12 + int(match.group(2)) - 1
+
+
+def _month_ordinals(months: List[str]) -> np.ndarray:
+    """Months since year 0 for YYYY-MM labels (positions if any label is not a month)"""
+    ordinals = [_month_ordinal(month) for month in months]
+    if None in ordinals:
+        return np.arange(len(months))
+    return np.asarray(ordinals)
+
+
+def _period_measures(months: List[str], index: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    YoY, annualized 3- and 6-month changes and 12-month rolling average
+    
+    The (..., T) index is first placed on a gap-free calendar grid, so lags
+    are taken by date: a month missing from months (or NaN in index) makes
+    every measure that needs it NaN instead of silently comparing against
+    the wrong month. The annualized rates compound the change over the
+    window to a yearly rate; the index is not seasonally adjusted here.
+    
+    Returns:
+        Arrays shaped like index, keyed by PERIOD_MEASURES
+    """
+    index = np.asarray(index, dtype=float)
+    if index.shape[-1] == 0:
+        return {name: index.copy() for name in PERIOD_MEASURES}
+    
+    ordinals = _month_ordinals(months)
+    positions = ordinals - ordinals.min()
+    grid = np.full(index.shape[:-1] + (positions.max() + 1,), np.nan)
+    grid[..., positions] = index
+    
+    def lagged(months_back):
+        shifted = np.full(grid.shape, np.nan)
+        if months_back < grid.shape[-1]:
+            shifted[..., months_back:] = grid[..., :-months_back]
+        return shifted
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        measures = {
+            'YoY_Change_%': (grid / lagged(12) - 1) * 100,
+            'Annualized_3M_%': ((grid / lagged(3)) ** 4 - 1) * 100,
+            'Annualized_6M_%': ((grid / lagged(6)) ** 2 - 1) * 100,
+        }
+    
+    # Rolling mean over 12 calendar months, only where all 12 have an index
+    observed = np.isfinite(grid)
+    zero_pad = np.zeros(grid.shape[:-1] + (1,))
+    total = np.concatenate([zero_pad, np.cumsum(np.where(observed, grid, 0.0), axis=-1)], axis=-1)
+    count = np.concatenate([zero_pad, np.cumsum(observed, axis=-1)], axis=-1)
+    rolling = np.full(grid.shape, np.nan)
+    if grid.shape[-1] >= 12:
+        window_total = total[..., 12:] - total[..., :-12]
+        window_count = count[..., 12:] - count[..., :-12]
+        rolling[..., 11:] = np.where(window_count == 12, window_total / 12, np.nan)
+    measures['Rolling_12M_Avg'] = rolling
+    
+    return {name: values[..., positions] for name, values in measures.items()}
+
+
+def _item_changes(values: np.ndarray, available: np.ndarray, months: List[str],
+                  months_back: int) -> np.ndarray:
+    """
+    Item-level % change over months_back calendar months
+    
+    Args:
+        values, available: (..., N, T) price relatives and availability
+        months: Month labels of the T axis
+        months_back: 1 for MoM, 12 for YoY
+    
+    Returns:
+        (..., N, T) changes, NaN where either month has no price or the
+        earlier month is not loaded
+    """
+    ordinals = _month_ordinals(months)
+    lag_columns = pd.Index(ordinals).get_indexer(ordinals - months_back)
+    has_lag = lag_columns >= 0
+    lag_columns = np.maximum(lag_columns, 0)
+    
+    previous = np.take(values, lag_columns, axis=-1)
+    valid = (np.asarray(available, dtype=bool)
+             & np.take(available, lag_columns, axis=-1).astype(bool)
+             & has_lag & (previous > 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid, (values / previous - 1) * 100, np.nan)
+
+
+def _distribution_measures(changes: np.ndarray, weights: np.ndarray,
+                           trims: List[float]) -> Dict[str, np.ndarray]:
+    """
+    Weighted median and trimmed means of item changes, for every month at once
+    
+    Items are sorted by change within each month; each item then covers the
+    slice [lower, upper) of the cumulative weight share. A trimmed mean
+    keeps the part of every slice inside [trim, 1 - trim), so an item
+    straddling a cut-off counts with a partial weight.
+    
+    Args:
+        changes: (..., N, T) item changes, NaN where undefined
+        weights: (..., N) item weights, broadcast over months
+        trims: Share of weight cut from each tail (0.15 = 15%/15%)
+    
+    Returns:
+        (..., T) arrays keyed 'Weighted Median' and 'Trimmed Mean <trim>%'
+    """
+    changes = np.moveaxis(changes, -1, -2)
+    item_weights = np.where(np.isnan(changes), 0.0, weights[..., np.newaxis, :])
+    
+    # NaN sorts last and carries zero weight
+    order = np.argsort(changes, axis=-1)
+    sorted_changes = np.nan_to_num(np.take_along_axis(changes, order, axis=-1))
+    sorted_weights = np.take_along_axis(item_weights, order, axis=-1)
+    
+    total = sorted_weights.sum(axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        upper = np.cumsum(sorted_weights, axis=-1) / total
+        lower = upper - sorted_weights / total
+    has_data = total[..., 0] > 0
+    
+    median_pos = np.argmax(upper >= 0.5, axis=-1)[..., np.newaxis]
+    measures = {
+        'Weighted Median': np.where(
+            has_data, np.take_along_axis(sorted_changes, median_pos, axis=-1)[..., 0], np.nan
+        )
+    }
+    for trim in trims:
+        kept = np.clip(np.minimum(upper, 1 - trim) - np.maximum(lower, trim), 0.0, None)
+        kept = np.where(np.isnan(kept), 0.0, kept)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = (kept * sorted_changes).sum(axis=-1) / kept.sum(axis=-1)
+        measures[f'Trimmed Mean {trim * 100:g}%'] = np.where(has_data, mean, np.nan)
+    
+    return measures
+
+
+def _draw_weights(rng: np.random.Generator, weights: np.ndarray, n_draws: int,
+                  method: str, effective_size: float) -> np.ndarray:
+    """
+    Perturbed copies of a weight vector, each with the same total
+    
+    'dirichlet' draws shares from Dirichlet(effective_size x shares);
+    'bootstrap' resamples effective_size units of weight mass with
+    replacement (multinomial). Both have share variance close to
+    s(1 - s) / effective_size. Items with zero weight stay at zero.
+    
+    Returns:
+        (n_draws, items) array
+    """
+    positive = weights > 0
+    total = weights[positive].sum()
+    shares = weights[positive] / total
+    
+    if method == 'dirichlet':
+        drawn = rng.dirichlet(shares * effective_size, size=n_draws)
+    elif method == 'bootstrap':
+        drawn = rng.multinomial(int(effective_size), shares, size=n_draws) / int(effective_size)
+    else:
+        raise Exception(f"Unknown weight draw method: {method} (use 'dirichlet' or 'bootstrap')")
+    
+    draws = np.zeros((n_draws, len(weights)))
+    draws[:, positive] = drawn * total
+    return draws
+
+
+def _optional_float(value) -> float:
+    """Float, or None for NaN (measures that need months not loaded)"""
+    return None if np.isnan(value) else float(value)
+
+
+def _latest_period_measures(months: List[str], index: np.ndarray) -> List[float]:
+    """
+    PERIOD_MEASURES for the last month only
+    
+    Months must be in calendar order. Only the trailing MEASURE_LOOKBACK + 1
+    entries are used; they hold every month the measures reach back to.
+    """
+    window = MEASURE_LOOKBACK + 1
+    measures = _period_measures(list(months[-window:]), np.asarray(index, dtype=float)[-window:])
+    return [measures[name][-1] for name in PERIOD_MEASURES]
+
+
+def _series_result(variant: str, months: List[str], index: np.ndarray, mom: np.ndarray,
+                   items_count: int, total_weight: float) -> CPIResult:
+    """Wrap one index/MoM row as a CPIResult, skipping empty months"""
+    measures = _period_measures(months, index)
+    has_data = ~np.isnan(index)
+    return CPIResult(
+        variant, np.asarray(months, dtype=object)[has_data], index[has_data], mom[has_data],
+        np.array([measures[name][has_data] for name in PERIOD_MEASURES]),
+        items_count, total_weight
+    )
+
+
+def _copy_result(result: CPIResult) -> CPIResult:
+    """Copy a result so callers cannot alter a cached one (arrays are read-only)"""
+    return None if result is None else result.copy()
+
+
+def _parse_custom_entry(idx_config: Dict, require_value: bool = True) -> Tuple[Dict, str]:
+    """
+    Validate one custom index entry ({'name', 'value', 'weight'})
+    
+    Returns:
+        (entry, None) with the stripped name and float value/weight, or
+        (None, error message). With require_value=False only the name and
+        weight are checked (values are then whole series, checked by caller).
+    """
+    # Validate required fields
+    if not isinstance(idx_config.get('name'), str) or not idx_config['name'].strip():
+        return None, "Missing or invalid index name"
+    
+    try:
+        value = float(idx_config['value']) if require_value else None
+        weight = float(idx_config['weight'])
+    except (ValueError, TypeError):
+        return None, f"Invalid values for {idx_config['name']}: must be numbers"
+    
+    if require_value and value <= 0:
+        return None, f"{idx_config['name']}: Index value must be positive"
+    
+    if weight < 0:
+        return None, f"{idx_config['name']}: Weight cannot be negative"
+    
+    return {'name': idx_config['name'].strip(), 'value': value, 'weight': weight}, None
+
+
+def _weight_imbalance(total_weight):
+    """True where blend weights do not add up to 100 (allowing small rounding errors)"""
+    return np.abs(total_weight - 100.0) > 0.01
+
+
+class _ColumnBuffer:
+    """
+    2-D array that grows along its columns with amortized doubling
+    
+    The initial array is wrapped without copying (it may be a read-only
+    memory map), and columns past length are spare capacity; the first
+    append past its capacity moves to a new buffer.
+    """
+    
+    def __init__(self, array: np.ndarray, length: int = None):
+        self._data = array
+        self._length = array.shape[1] if length is None else length
+    
+    @property
+    def array(self) -> np.ndarray:
+        """View of the filled columns"""
+        return self._data[:, :self._length]
+    
+    def append(self, column: np.ndarray):
+        """Write one column, reallocating only when capacity runs out"""
+        if self._length == self._data.shape[1]:
+            grown = np.empty((self._data.shape[0], max(2 * self._length, 1)), dtype=float)
+            grown[:, :self._length] = self._data[:, :self._length]
+            self._data = grown
+        self._data[:, self._length] = column
+        self._length += 1
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    """Read-only view of an array, without copying"""
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
+
+
+class PriceSnapshot:
+    """
+    Immutable, versioned data that calculations run against
+    
+    Holds the catalogue (weights), the loaded prices as an aligned items x
+    months matrix and the precomputed headline and node partial sums, all
+    as read-only arrays. A snapshot is never modified: loading or appending
+    prices builds a new one and the engine swaps its reference in a single
+    assignment. Each calculation reads one snapshot throughout, so any number
+    of threads can share an engine without locks while prices are reloaded.
+    """
+    
+    __slots__ = ('version', 'catalogue', 'months', 'values', 'available', 'price_rows',
+                 'total_sums', 'node_sums', '_source_prices', '_source_months', '_prices_memo')
+    
+    def __init__(self, version: int, catalogue: CPICatalogue, prices_df: pd.DataFrame = None,
+                 months: List[str] = None, values: np.ndarray = None, available: np.ndarray = None,
+                 price_rows: np.ndarray = None, total_sums: Dict = None, node_sums: Dict = None,
+                 source_months: int = None):
+        """
+        Args:
+            version: Price version, unique per engine (keys the result cache)
+            catalogue: Item and node index of the weights
+            prices_df: Loaded price table, for display (treat as read-only)
+            months: Month labels of the price matrix columns
+            values, available: Aligned items x months price matrix
+            price_rows: Items with a price row
+            total_sums, node_sums: Partial sums from CPIEngine._partial_sums,
+                plus 'price_rows' counts
+            source_months: Number of leading months prices_df holds (default
+                all); later months were appended to the matrix only
+        """
+        def frozen_sums(sums):
+            return None if sums is None else {
+                key: _read_only(value) if isinstance(value, np.ndarray) else value
+                for key, value in sums.items()
+            }
+        
+        fields = {
+            'version': version,
+            'catalogue': catalogue,
+            'months': None if months is None else list(months),
+            'values': None if values is None else _read_only(values),
+            'available': None if available is None else _read_only(available),
+            'price_rows': None if price_rows is None else _read_only(price_rows),
+            'total_sums': frozen_sums(total_sums),
+            'node_sums': frozen_sums(node_sums),
+            '_source_prices': prices_df,
+            '_source_months': len(months or []) if source_months is None else source_months,
+            '_prices_memo': {},
+        }
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+    
+    def __setattr__(self, name, value):
+        raise Exception("PriceSnapshot is read-only; load or append prices to get a new one")
+    
+    def __repr__(self) -> str:
+        months = len(self.months) if self.months is not None else 0
+        return f"PriceSnapshot(version={self.version}, {months} months)"
+    
+    @property
+    def has_prices(self) -> bool:
+        return self._source_prices is not None
+    
+    @property
+    def prices_df(self) -> pd.DataFrame:
+        """Loaded price table, with appended months filled in from the matrix on first access"""
+        source, loaded = self._source_prices, self._source_months
+        if source is None or loaded >= len(self.months):
+            return source
+        if 'frame' not in self._prices_memo:
+            relatives = np.where(self.available[:, loaded:] > 0, self.values[:, loaded:], np.nan)
+            rows = pd.Index(self.catalogue.item_codes).get_indexer(source['Item_Code'])
+            relatives = np.where((rows >= 0)[:, np.newaxis], relatives[np.maximum(rows, 0)], np.nan)
+            self._prices_memo['frame'] = source.assign(**dict(zip(self.months[loaded:], relatives.T)))
+        return self._prices_memo['frame']
 
 
 class CPIEngine:
-    """Core CPI calculation engine with exclusion support"""
+    """
+    Core CPI calculation engine with exclusion support
+    
+    Prices live in an immutable PriceSnapshot that is replaced whole on
+    every load, so one engine can be shared by concurrent sessions: reads
+    never lock, and only loads and appends are serialized.
+    """
     
-    def __init__(self, weights_dir: Path):
+    def __init__(self, weights_dir: Path, cache_size: int = 256):
         """Initialize with weights and price data"""
         self.weights_dir = Path(weights_dir)
         self.items_df = None
@@ -20,11 +455,54 @@ class CPIEngine:
         self.groups_df = None
         self.classes_df = None
         self.subclasses_df = None
-        self.prices_df = None
-        self.months = None
         self.hierarchy = None
         
+        # Integer-coded items and hierarchy nodes with per-node item masks
+        self.catalogue = None
+        
+        # Growable storage behind the snapshots' price matrices and per-month sums (writer side only)
+        self._value_buffer = None
+        self._available_buffer = None
+        self._total_buffers = None
+        self._node_buffers = None
+        # Reentrant, so a writer can read, rebuild and install under one hold
+        self._write_lock = threading.RLock()
+        self._versions = itertools.count(1)
+        
+        # LRU cache of results, keyed by canonical selection and price version
+        self.cache_size = cache_size
+        self._result_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        
         self._load_weights()
+        self._snapshot = PriceSnapshot(0, self.catalogue)
+    
+    # =========================================================================
+    # SNAPSHOT ACCESS
+    # =========================================================================
+    
+    @property
+    def snapshot(self) -> PriceSnapshot:
+        """Current data snapshot; hold on to it to run several calls on one version"""
+        return self._snapshot
+    
+    @property
+    def prices_df(self) -> pd.DataFrame:
+        return self._snapshot.prices_df
+    
+    @property
+    def months(self) -> List[str]:
+        months = self._snapshot.months
+        return None if months is None else list(months)
+    
+    @property
+    def item_paths(self) -> pd.DataFrame:
+        return self.catalogue.item_paths
+    
+    @property
+    def parent_codes(self) -> Dict[str, pd.Series]:
+        return self.catalogue.parent_codes
     
     def _load_weights(self):
         """Load all weight files"""
@@ -35,6 +513,10 @@ class CPIEngine:
             self.groups_df = pd.read_csv(self.weights_dir / 'groups.csv')
             self.divisions_df = pd.read_csv(self.weights_dir / 'divisions.csv')
             
+            self.catalogue = CPICatalogue(
+                self.items_df, self.subclasses_df, self.classes_df,
+                self.groups_df, self.divisions_df
+            )
             # Build hierarchy for UI
             self._build_hierarchy()
         except FileNotFoundError as e:
@@ -42,229 +524,1318 @@ class CPIEngine:
     
     def _build_hierarchy(self):
         """Build nested hierarchy structure for UI"""
-        self.hierarchy = {}
+        # Items per class, ordered by subclass position in subclasses_df, then item position
+        catalogue = self.catalogue
+        class_rows, subclass_rows = catalogue.item_node_ids[2], catalogue.item_node_ids[3]
+        subclass_order = {}
+        for position, code in enumerate(clean_codes(self.subclasses_df['Subclass_Code'])):
+            subclass_order.setdefault(code, position)
+        node_order = np.array([
+            subclass_order.get(code, -1) if level == 'subclass' else -1
+            for level, code in catalogue.node_keys
+        ])
         
-        for _, div_row in self.divisions_df.iterrows():
-            div_code = str(div_row['Division_Code']).strip()
-            div_name = div_row['Division_Name']
-            div_weight = float(div_row['Weight'])
-            
-            # Get groups in this division
-            groups_in_div = self.groups_df[
-                self.groups_df['Division_Code'].astype(str) == div_code
-            ]
-            
+        # Rank subclass nodes by (class, position) so one stable sort of items does the grouping
+        node_rank = np.empty(catalogue.n_nodes, dtype=int)
+        node_rank[np.lexsort((node_order, catalogue.node_parents))] = np.arange(catalogue.n_nodes)
+        in_class = np.flatnonzero(class_rows >= 0)
+        order = in_class[np.argsort(node_rank[subclass_rows[in_class]], kind='stable')]
+        sorted_rows = class_rows[order]
+        sorted_items = catalogue.item_codes[order].tolist()
+        
+        starts = np.flatnonzero(np.r_[True, sorted_rows[1:] != sorted_rows[:-1]]) if len(order) else []
+        ends = list(starts[1:]) + [len(order)]
+        items_by_class = {
+            catalogue.node_keys[sorted_rows[start]][1]: sorted_items[start:end]
+            for start, end in zip(starts, ends)
+        }
+        
+        self.hierarchy = {}
+        for div_code, div_name, div_weight in zip(
+            clean_codes(self.divisions_df['Division_Code']),
+            self.divisions_df['Division_Name'].tolist(), self.divisions_df['Weight'].tolist()
+        ):
             self.hierarchy[div_code] = {
                 'name': div_name,
-                'weight': div_weight,
+                'weight': float(div_weight),
                 'groups': {}
             }
-            
-            for _, grp_row in groups_in_div.iterrows():
-                grp_code = str(grp_row['Group_Code']).strip()
-                grp_name = grp_row['Group_Name']
-                grp_weight = float(grp_row['Weight'])
-                
-                # Get classes in this group
-                classes_in_grp = self.classes_df[
-                    self.classes_df['Group_Code'].astype(str) == grp_code
-                ]
-                
-                self.hierarchy[div_code]['groups'][grp_code] = {
-                    'name': grp_name,
-                    'weight': grp_weight,
-                    'classes': {}
+        
+        group_nodes = {}
+        for grp_code, grp_name, grp_weight, div_code in zip(
+            clean_codes(self.groups_df['Group_Code']), self.groups_df['Group_Name'].tolist(),
+            self.groups_df['Weight'].tolist(), clean_codes(self.groups_df['Division_Code'])
+        ):
+            if div_code not in self.hierarchy:
+                continue
+            node = {'name': grp_name, 'weight': float(grp_weight), 'classes': {}}
+            self.hierarchy[div_code]['groups'][grp_code] = node
+            group_nodes.setdefault(grp_code, []).append(node)
+        
+        for cls_code, cls_name, cls_weight, grp_code in zip(
+            clean_codes(self.classes_df['Class_Code']), self.classes_df['Class_Name'].tolist(),
+            self.classes_df['Weight'].tolist(), clean_codes(self.classes_df['Group_Code'])
+        ):
+            item_list = items_by_class.get(cls_code, [])
+            for node in group_nodes.get(grp_code, []):
+                node['classes'][cls_code] = {
+                    'name': cls_name,
+                    'weight': float(cls_weight),
+                    'item_count': len(item_list),
+                    'items': list(item_list)
                 }
-                
-                for _, cls_row in classes_in_grp.iterrows():
-                    cls_code = str(cls_row['Class_Code']).strip()
-                    cls_name = cls_row['Class_Name']
-                    cls_weight = float(cls_row['Weight'])
-                    
-                    # Get items in this class
-                    items_in_cls = self.items_df[
-                        self.items_df['Subclass_Code'].str.startswith(
-                            cls_code.split('.')[0] + '.' + cls_code.split('.')[1] if '.' in cls_code else cls_code,
-                            na=False
-                        )
-                    ]
-                    
-                    # Simpler approach: get items via subclass
-                    subclasses_in_cls = self.subclasses_df[
-                        self.subclasses_df['Class_Code'].astype(str) == cls_code
-                    ]
-                    
-                    item_list = []
-                    for _, sub_row in subclasses_in_cls.iterrows():
-                        sub_code = str(sub_row['Subclass_Code']).strip()
-                        items = self.items_df[
-                            self.items_df['Subclass_Code'].astype(str) == sub_code
-                        ]['Item_Code'].tolist()
-                        item_list.extend(items)
-                    
-                    self.hierarchy[div_code]['groups'][grp_code]['classes'][cls_code] = {
-                        'name': cls_name,
-                        'weight': cls_weight,
-                        'item_count': len(item_list),
-                        'items': item_list
-                    }
     
-    def load_prices(self, prices_file: Path) -> bool:
-        """Load price data"""
+    def _basket_mask(self, excluded_divisions: List[str] = None,
+                     excluded_groups: List[str] = None,
+                     excluded_classes: List[str] = None,
+                     excluded_subclasses: List[str] = None,
+                     excluded_items: List[str] = None,
+                     included: Dict[str, List[str]] = None,
+                     include_only: Dict[str, List[str]] = None) -> np.ndarray:
+        """
+        Resolve exclusions and inclusions to the item mask of the basket
+        
+        The basket starts from include_only (all items if not given) and
+        drops the excluded codes, except items re-included by included.
+        Codes resolve through the catalogue's precomputed node bitsets, and
+        unknown codes are ignored.
+        
+        Args:
+            excluded_divisions ... excluded_items: Codes to drop at each level
+            included: Codes kept despite an excluded parent, keyed by level
+                ('division', 'group', 'class', 'subclass' or 'item'), e.g.
+                {'class': ['01.1.4']} with excluded_divisions=['1.0']
+            include_only: Codes making up the whole basket, keyed by level
+        """
+        catalogue = self.catalogue
+        if include_only is None:
+            basket = np.ones(catalogue.n_items, dtype=bool)
+        else:
+            basket = catalogue.mask_for_codes(include_only)
+        
+        excluded = catalogue.mask_for_codes({
+            'division': excluded_divisions, 'group': excluded_groups, 'class': excluded_classes,
+            'subclass': excluded_subclasses, 'item': excluded_items,
+        })
+        if included:
+            excluded &= ~catalogue.mask_for_codes(included)
+        return basket & ~excluded
+    
+    def _basket_sums(self, snapshot: PriceSnapshot, masks: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Partial sums of item baskets (one per row of masks)
+        
+        Each basket, or its complement when that has fewer items, is cut
+        into whole nodes plus single items (CPICatalogue.mask_cover), so its
+        sums are a few precomputed node rows plus the rows of the single
+        items, added to or subtracted from the headline. Dropping 40
+        scattered items costs about as much as dropping a division.
+        
+        Returns:
+            Dict of (baskets, months) weighted_sum, weight_total and
+            price_count, plus price_rows per basket
+        """
+        catalogue = self.catalogue
+        total_coef = np.zeros(len(masks))
+        # (basket row, node or item id, sign) triplets of the sparse coefficient matrices
+        node_terms, item_terms = [], []
+        
+        for row, mask in enumerate(masks):
+            sign = 1.0
+            if 2 * np.count_nonzero(mask) > len(mask):
+                total_coef[row], sign, mask = 1.0, -1.0, ~mask
+            node_ids, item_ids = catalogue.mask_cover(mask)
+            node_terms.append((np.full(len(node_ids), row), node_ids, np.full(len(node_ids), sign)))
+            item_terms.append((np.full(len(item_ids), row), item_ids, np.full(len(item_ids), sign)))
+        
+        rows, node_ids, signs = (np.concatenate(parts) for parts in zip(*node_terms))
+        node_coef = sparse.csr_matrix((signs, (rows, node_ids)), shape=(len(masks), catalogue.n_nodes))
+        sums = {
+            key: np.multiply.outer(total_coef, snapshot.total_sums[key]) + node_coef @ snapshot.node_sums[key]
+            for key in ('weighted_sum', 'weight_total', 'price_count', 'price_rows')
+        }
+        
+        # Single items: only the rows of the items in some cover are read
+        rows, item_ids, signs = (np.concatenate(parts) for parts in zip(*item_terms))
+        if len(item_ids):
+            items, columns = np.unique(item_ids, return_inverse=True)
+            item_coef = sparse.csr_matrix((signs, (rows, columns)), shape=(len(masks), len(items)))
+            weighted_coef = item_coef.multiply(catalogue.item_weights[items]).tocsr()
+            available = snapshot.available[items]
+            sums['weighted_sum'] += weighted_coef @ snapshot.values[items]
+            sums['weight_total'] += weighted_coef @ available
+            sums['price_count'] += item_coef @ available
+            sums['price_rows'] += item_coef @ snapshot.price_rows[items].astype(float)
+        return sums
+    
+    def _result_from_basket(self, snapshot: PriceSnapshot, mask: np.ndarray, variant_name: str) -> Dict:
+        """Build a Laspeyres result for an item basket from node and item sums"""
+        if not snapshot.has_prices or not mask.any():
+            return None
+        
+        sums = {key: values[0] for key, values in self._basket_sums(snapshot, mask[np.newaxis, :]).items()}
+        if sums.pop('price_rows') <= 0:
+            return None
+        
+        index, mom = _index_from_sums(**sums)
+        weight_sum = self.catalogue.item_weights[mask].sum()
+        
+        return _series_result(variant_name, snapshot.months, index, mom, int(mask.sum()), weight_sum)
+    
+    def load_prices(self, prices_file: Path, use_cache: bool = True) -> bool:
+        """
+        Load price data
+        
+        Month columns (YYYY-MM or Price_Relative_YYYY-MM) are detected by
+        pattern. Repeat loads read the columnar sidecar cache written next to
+        the workbook instead of parsing Excel again (see price_store).
+        """
         try:
-            self.prices_df = pd.read_excel(prices_file)
+            prices_df, months = read_price_table(prices_file, use_cache=use_cache)
+            return self.load_price_frame(prices_df, months)
+        except Exception as e:
+            raise Exception(f"Error loading prices: {e}")
+    
+    def load_price_frame(self, prices_df: pd.DataFrame, months: List[str] = None) -> bool:
+        """
+        Load prices from a DataFrame with Item_Code and month columns
+        
+        The new snapshot is built off to the side and swapped in at the end;
+        calculations already running finish on the previous one.
+        
+        Args:
+            prices_df: Price table as read by load_prices
+            months: Month columns in calendar order (default: detected);
+                date headers are renamed to 'YYYY-MM'
+        """
+        prices_df, months = normalize_month_columns(prices_df, months)
+        values, available, price_rows = self._build_price_matrix(prices_df, months)
+        self._install_prices(prices_df, months, values, available, price_rows)
+        return True
+    
+    def load_price_tensor(self, store: PriceTensorStore, state: str, sector: str) -> bool:
+        """
+        Load one state and sector panel from a memory-mapped tensor store
+        
+        When the store's item axis follows items_df the price matrix used by
+        the index calculations is a view into the mapping, so engines sharing
+        a store share its pages. prices_df holds a NaN-masked copy of just
+        this panel for display.
+        
+        Args:
+            store: Open PriceTensorStore
+            state: State label in the store
+            sector: Sector label in the store
+        """
+        try:
+            item_codes = self.catalogue.item_codes
+            values, available = store.panel(state, sector, item_codes=item_codes)
+            months = list(store.labels['month'])
             
-            # Identify month columns (format: YYYY-MM or Price_Relative_YYYY-MM)
-            month_cols = [col for col in self.prices_df.columns 
-                         if '-' in str(col) and ('20' in str(col) or '21' in str(col))]
-            self.months = sorted(month_cols)
+            prices_df = pd.DataFrame(np.where(available, values, np.nan), columns=months)
+            prices_df.insert(0, 'Item_Code', item_codes)
             
+            self._install_prices(prices_df, months, values, available, available.any(axis=1))
             return True
         except Exception as e:
-            raise Exception(f"Error loading prices: {e}")
+            raise Exception(f"Error loading price tensor: {e}")
     
     def get_headline_index(self) -> Dict:
         """Calculate headline CPI (all items)"""
-        selected_items = self.items_df['Item_Code'].tolist()
-        return self._calculate_laspeyres(selected_items, "Headline CPI")
+        snapshot = self._snapshot
+        basket = np.ones(self.catalogue.n_items, dtype=bool)
+        return self._cached(
+            snapshot, ('headline',), lambda: self._result_from_basket(snapshot, basket, "Headline CPI")
+        )
     
     def get_index_with_exclusions(self, excluded_divisions: List[str] = None, 
                                   excluded_groups: List[str] = None,
-                                  excluded_classes: List[str] = None) -> Dict:
-        """Calculate CPI with exclusions"""
-        excluded_divisions = excluded_divisions or []
-        excluded_groups = excluded_groups or []
-        excluded_classes = excluded_classes or []
-        
-        # Get all item codes
-        all_items = set(self.items_df['Item_Code'].tolist())
-        excluded_items = set()
-        
-        # Exclude by division
-        for div_code in excluded_divisions:
-            div_groups = self.hierarchy.get(div_code, {}).get('groups', {})
-            for grp_code in div_groups.keys():
-                classes_dict = div_groups[grp_code].get('classes', {})
-                for cls_code in classes_dict.keys():
-                    excluded_items.update(classes_dict[cls_code].get('items', []))
-        
-        # Exclude by group
-        for grp_code in excluded_groups:
-            for div_code, div_data in self.hierarchy.items():
-                if grp_code in div_data['groups']:
-                    classes_dict = div_data['groups'][grp_code].get('classes', {})
-                    for cls_code in classes_dict.keys():
-                        excluded_items.update(classes_dict[cls_code].get('items', []))
-        
-        # Exclude by class
-        for cls_code in excluded_classes:
-            for div_code, div_data in self.hierarchy.items():
-                for grp_code, grp_data in div_data['groups'].items():
-                    if cls_code in grp_data.get('classes', {}):
-                        excluded_items.update(grp_data['classes'][cls_code].get('items', []))
-        
-        selected_items = list(all_items - excluded_items)
-        
-        # Calculate excluded weight
-        excluded_weight = self.items_df[
-            self.items_df['Item_Code'].isin(excluded_items)
-        ]['Weight'].sum()
-        
-        result = self._calculate_laspeyres(selected_items, "CPI with Exclusions")
-        result['excluded_items_count'] = len(excluded_items)
-        result['excluded_weight'] = float(excluded_weight)
+                                  excluded_classes: List[str] = None,
+                                  excluded_subclasses: List[str] = None,
+                                  excluded_items: List[str] = None,
+                                  included: Dict[str, List[str]] = None,
+                                  include_only: Dict[str, List[str]] = None) -> Dict:
+        """
+        Calculate CPI with exclusions (headline minus precomputed node and item sums)
         
-        return result
+        Args:
+            excluded_divisions ... excluded_items: Codes to drop at each level
+            included: Codes kept despite an excluded parent, keyed by level
+                (e.g. {'class': ['01.1.4']} to keep one class of an excluded division)
+            include_only: Codes making up the whole basket, keyed by level
+                (e.g. {'group': ['1.1'], 'item': ['01.2.1.0.1.01']})
+        """
+        basket = self._basket_mask(
+            excluded_divisions, excluded_groups, excluded_classes, excluded_subclasses,
+            excluded_items, included, include_only
+        )
+        snapshot = self._snapshot
+        
+        def compute():
+            result = self._result_from_basket(snapshot, basket, "CPI with Exclusions")
+            if result is None:
+                return None
+            
+            result['excluded_items_count'] = int((~basket).sum())
+            result['excluded_weight'] = float(self.catalogue.item_weights[~basket].sum())
+            return result
+        
+        return self._cached(snapshot, ('basket', self.catalogue.mask_key(basket)), compute)
     
-    def _calculate_laspeyres(self, item_codes: List[str], variant_name: str) -> Dict:
+    def get_indices_for_scenarios(self, scenarios: Dict[str, Dict]) -> pd.DataFrame:
         """
-        Calculate Laspeyres index
-        Formula: L = SUM(P_t / P_0 * W) / SUM(W) * 100
+        Calculate many exclusion variants with a single matrix product
+        
+        Args:
+            scenarios: Mapping of variant name to exclusions, using the same
+                keyword names as get_index_with_exclusions, e.g.
+                {'CPI ex Food': {'excluded_divisions': ['1.0']}}
+        
+        Returns:
+            Tidy DataFrame with columns Variant, Month, Index, MoM_Change_%,
+            the PERIOD_MEASURES, Items_Count and Excluded_Weight (one row per
+            variant and month)
+        """
+        batch = self.get_scenario_batch(scenarios)
+        if batch is None:
+            columns = ['Variant', 'Month', 'Index', 'MoM_Change_%', *PERIOD_MEASURES, 'Items_Count', 'Excluded_Weight']
+            return pd.DataFrame(columns=columns)
+        return batch.to_frame()
+    
+    def get_scenario_batch(self, scenarios: Dict[str, Dict]) -> CPIBatchResult:
         """
-        if not item_codes or self.prices_df is None:
+        Same as get_indices_for_scenarios, as (variants x months) arrays
+        
+        Returns:
+            CPIBatchResult, or None without scenarios or prices
+        """
+        snapshot = self._snapshot
+        if not scenarios or not snapshot.has_prices:
             return None
         
-        # Filter data to selected items
-        items_data = self.items_df[self.items_df['Item_Code'].isin(item_codes)].copy()
-        prices_data = self.prices_df[self.prices_df['Item_Code'].isin(item_codes)].copy()
+        names = list(scenarios.keys())
+        baskets = self._scenario_masks(scenarios)
         
-        if len(items_data) == 0 or len(prices_data) == 0:
-            return None
+        sums = self._basket_sums(snapshot, baskets)
+        sums.pop('price_rows')
+        index, mom = _index_from_sums(**sums)
+        measures = _period_measures(snapshot.months, index)
         
-        # Get weights and normalize to sum to 100
-        weights = items_data.set_index('Item_Code')['Weight']
-        weight_sum = weights.sum()
-        weights_normalized = (weights / weight_sum) * 100
+        excluded_weight = (~baskets) @ self.catalogue.item_weights
         
-        # Calculate index for each month
-        monthly_data = []
+        return CPIBatchResult(
+            names, snapshot.months, index, mom, np.array([measures[name] for name in PERIOD_MEASURES]),
+            items_count=baskets.sum(axis=1),
+            total_weight=baskets @ self.catalogue.item_weights,
+            excluded_weight=excluded_weight,
+        )
+    
+    def _scenario_masks(self, scenarios: Dict[str, Dict]) -> np.ndarray:
+        """Scenarios x items basket masks, one row per scenario in order"""
+        baskets = np.ones((len(scenarios), self.catalogue.n_items), dtype=bool)
+        for row, selection in enumerate(scenarios.values()):
+            baskets[row] = self._basket_mask(**(selection or {}))
+        return baskets
+    
+    def get_panel_indices(self, store: PriceTensorStore, scenarios: Dict[str, Dict] = None,
+                          state_weights: Dict[str, object] = None) -> pd.DataFrame:
+        """
+        Calculate indices for every state and sector of a price panel at once
+        
+        All states, sectors and variants come out of one broadcast matrix
+        product over the store's (state, sector, item, month) tensor, so a
+        state league table for a core measure is a single call.
         
-        for month in self.months:
-            # Get price relatives for this month
-            month_prices = prices_data.set_index('Item_Code')[month]
+        Args:
+            store: Open PriceTensorStore
+            scenarios: Mapping of variant name to exclusions, as in
+                get_indices_for_scenarios (default: headline only)
+            state_weights: Optional item weights per state, as a Series or
+                dict keyed by Item_Code or an array aligned with items_df.
+                States not listed use the national weights.
+        
+        Returns:
+            Tidy DataFrame with columns Variant, State, Sector, Month, Index,
+            MoM_Change_% and the PERIOD_MEASURES (months without prices are
+            dropped)
+        """
+        columns = ['Variant', 'State', 'Sector', 'Month', 'Index', 'MoM_Change_%', *PERIOD_MEASURES]
+        scenarios = scenarios or {'Headline CPI': {}}
+        
+        try:
+            names = list(scenarios.keys())
+            included = self._scenario_masks(scenarios)
             
-            # Match items
-            matched_items = list(set(month_prices.index) & set(weights_normalized.index))
+            states, sectors, months = (store.labels[dim] for dim in ('state', 'sector', 'month'))
+            values, available = store.aligned(self.catalogue.item_codes)
+            weights = self._state_weight_matrix(states, state_weights)
             
-            if len(matched_items) == 0:
+            # (states, 1, 1, items) weights broadcast against (variants, items) masks
+            index, mom = _laspeyres_kernel(
+                values, available, included, weights[:, np.newaxis, np.newaxis, :]
+            )
+        except Exception as e:
+            raise Exception(f"Error calculating panel indices: {e}")
+        
+        # (states, sectors, variants, months) -> variant-major rows
+        index = index.transpose(2, 0, 1, 3)
+        mom = mom.transpose(2, 0, 1, 3)
+        grid = pd.MultiIndex.from_product([names, states, sectors, months], names=columns[:4])
+        frame = grid.to_frame(index=False)
+        frame['Index'] = index.ravel()
+        frame['MoM_Change_%'] = mom.ravel()
+        for name, values in _period_measures(months, index).items():
+            frame[name] = values.ravel()
+        
+        return frame.dropna(subset=['Index']).reset_index(drop=True)
+    
+    def _state_weight_matrix(self, states: List[str], state_weights: Dict[str, object] = None) -> np.ndarray:
+        """States x items weight matrix, national weights where none are given"""
+        weights = np.tile(self.catalogue.item_weights, (len(states), 1))
+        for state, state_weight in (state_weights or {}).items():
+            if state not in states:
                 continue
+            if isinstance(state_weight, dict):
+                state_weight = pd.Series(state_weight)
+            if isinstance(state_weight, pd.Series):
+                state_weight = state_weight.reindex(self.catalogue.item_codes).fillna(0.0)
+            weights[states.index(state)] = np.asarray(state_weight, dtype=float)
+        return weights
+    
+    def simulate_weight_uncertainty(self, scenarios: Dict[str, Dict] = None, draws: int = 1000,
+                                    method: str = 'dirichlet', effective_size: float = 5000,
+                                    percentiles: List[float] = (5, 50, 95), chunk_size: int = 250,
+                                    seed: int = None) -> pd.DataFrame:
+        """
+        Percentile bands of index and inflation under sampling error in the weights
+        
+        Draws perturbed item weight vectors and evaluates every variant for
+        every draw with one batched product per chunk of draws, so only a
+        (chunk, variants, items) weight stack is held at a time and just the
+        (draws, variants, months) indices are kept.
+        
+        Args:
+            scenarios: Mapping of variant name to exclusions, as in
+                get_indices_for_scenarios (default: headline only)
+            draws: Number of weight draws
+            method: 'dirichlet' or 'bootstrap' (see _draw_weights)
+            effective_size: Survey sample size the weights are taken to rest
+                on; larger means tighter bands
+            percentiles: Percentiles to report (0-100)
+            chunk_size: Draws evaluated per batch
+            seed: Random seed, for reproducible bands
+        
+        Returns:
+            Tidy DataFrame with columns Variant, Month, Measure ('Index',
+            'MoM_Change_%' or 'YoY_Change_%'), Point (published weights), Std
+            and one column per percentile (e.g. P5, P50, P95)
+        """
+        snapshot = self._snapshot
+        if not snapshot.has_prices:
+            return None
+        if int(draws) < 1 or int(chunk_size) < 1:
+            raise Exception(f"draws and chunk_size must be at least 1, got {draws} and {chunk_size}")
+        
+        scenarios = scenarios or {'Headline CPI': {}}
+        names = list(scenarios.keys())
+        included = self._scenario_masks(scenarios)
+        
+        rng = np.random.default_rng(seed)
+        weights = self.catalogue.item_weights
+        price_count = included.astype(float) @ snapshot.available
+        index = np.empty((int(draws),) + price_count.shape)
+        mom = np.empty_like(index)
+        for start in range(0, int(draws), int(chunk_size)):
+            stop = min(start + int(chunk_size), int(draws))
+            # (chunk, 1, items) draws x (variants, items) masks -> (chunk, variants, items)
+            drawn = included * _draw_weights(rng, weights, stop - start, method, effective_size)[:, np.newaxis, :]
+            index[start:stop], mom[start:stop] = _index_from_sums(
+                drawn @ snapshot.values, drawn @ snapshot.available,
+                np.broadcast_to(price_count, (stop - start,) + price_count.shape)
+            )
+        
+        point_index, point_mom = _laspeyres_kernel(snapshot.values, snapshot.available, included, weights)
+        simulated = {
+            'Index': (point_index, index),
+            'MoM_Change_%': (point_mom, mom),
+            'YoY_Change_%': (
+                _period_measures(snapshot.months, point_index)['YoY_Change_%'],
+                _period_measures(snapshot.months, index)['YoY_Change_%'],
+            ),
+        }
+        
+        frames = []
+        for measure, (point, values) in simulated.items():
+            frame = pd.MultiIndex.from_product(
+                [names, snapshot.months], names=['Variant', 'Month']
+            ).to_frame(index=False)
+            frame['Measure'] = measure
+            frame['Point'] = point.ravel()
+            with warnings.catch_warnings():
+                # Months without data are all-NaN across draws
+                warnings.simplefilter('ignore', RuntimeWarning)
+                frame['Std'] = np.nanstd(values, axis=0).ravel()
+                bands = np.nanpercentile(values, list(percentiles), axis=0)
+            for percentile, band in zip(percentiles, bands):
+                frame[f'P{percentile:g}'] = band.ravel()
+            frames.append(frame)
+        
+        return pd.concat(frames, ignore_index=True).dropna(subset=['Point']).reset_index(drop=True)
+    
+    def get_distribution_core(self, trims: List[float] = (0.15,), basis: str = 'MoM',
+                              store: PriceTensorStore = None,
+                              state_weights: Dict[str, object] = None) -> pd.DataFrame:
+        """
+        Weighted-median and trimmed-mean core inflation for every month
+        
+        Measures come from the weighted distribution of item-level changes,
+        sorted per month in one vectorized pass (no loop over months).
+        
+        Args:
+            trims: Share of weight cut from each tail, e.g. [0.15] for a
+                15%/15% trimmed mean (each must be in [0, 0.5))
+            basis: 'MoM' or 'YoY' item changes
+            store: Optional PriceTensorStore; when given, measures are
+                computed for all its states and sectors at once
+            state_weights: Optional item weights per state (with store), as
+                in get_panel_indices
+        
+        Returns:
+            Tidy DataFrame with columns Measure, Month and Value (% change),
+            plus State and Sector when a store is given
+        """
+        months_back = {'MoM': 1, 'YoY': 12}.get(basis)
+        if months_back is None:
+            raise Exception(f"Unknown basis: {basis} (use 'MoM' or 'YoY')")
+        if any(not 0 <= trim < 0.5 for trim in trims):
+            raise Exception(f"Trim levels must be in [0, 0.5): {list(trims)}")
+        
+        if store is None:
+            snapshot = self._snapshot
+            if not snapshot.has_prices:
+                return None
+            values, available, months = snapshot.values, snapshot.available, snapshot.months
+            weights = self.catalogue.item_weights
+            axes = {}
+        else:
+            values, available = store.aligned(self.catalogue.item_codes)
+            months = store.labels['month']
+            states = store.labels['state']
+            weights = self._state_weight_matrix(states, state_weights)[:, np.newaxis, :]
+            axes = {'State': states, 'Sector': store.labels['sector']}
+        
+        changes = _item_changes(values, available, months, months_back)
+        measures = _distribution_measures(changes, weights, list(trims))
+        
+        names = list(measures.keys())
+        grid = pd.MultiIndex.from_product(
+            [names, *axes.values(), months], names=['Measure', *axes.keys(), 'Month']
+        )
+        frame = grid.to_frame(index=False)
+        frame['Value'] = np.stack([measures[name] for name in names]).ravel()
+        
+        return frame.dropna(subset=['Value']).reset_index(drop=True)
+    
+    def optimize_exclusions(self, levels: List[str] = ('class', 'subclass'), max_excluded_weight: float = 30.0,
+                            objective: str = 'variance', trend_window: int = 12, beam_width: int = 5,
+                            max_exclusions: int = 8) -> pd.DataFrame:
+        """
+        Search for exclusion sets that give the smoothest core measure
+        
+        Beam search over disjoint sets of hierarchy nodes: each step adds one
+        node to every set in the beam and keeps the beam_width best sets
+        (beam_width=1 is greedy). All expansions of every set in the beam are
+        scored in one pass from the node partial sums, as (expansions x
+        months) array arithmetic.
+        
+        Args:
+            levels: Levels whose nodes may be excluded
+            max_excluded_weight: Budget for the total excluded weight (the
+                weights sum to 100)
+            objective: 'variance' (variance of MoM change) or 'tracking'
+                (RMS gap between MoM and the headline's trailing
+                trend_window-month average MoM)
+            trend_window: Months in the trend for 'tracking'
+            beam_width: Sets kept per step
+            max_exclusions: Largest number of nodes in a set
+        
+        Returns:
+            One row per set visited, best Score first, with Rank, Size,
+            Codes, Names, Excluded_Weight, Items_Count, Score, Frontier (no
+            other set has both less excluded weight and a lower score) and
+            Scenario (exclusions for get_indices_for_scenarios); the empty
+            set (headline) is included as the reference
+        """
+        if objective not in ('variance', 'tracking'):
+            raise Exception(f"Unknown objective: {objective} (use 'variance' or 'tracking')")
+        if int(beam_width) < 1:
+            raise Exception(f"beam_width must be at least 1, got {beam_width}")
+        snapshot = self._snapshot
+        if not snapshot.has_prices:
+            return None
+        
+        catalogue = self.catalogue
+        keys = ('weighted_sum', 'weight_total', 'price_count')
+        candidates = np.array([
+            node_id for node_id, (level, _) in enumerate(catalogue.node_keys) if level in levels
+        ], dtype=int)
+        candidate_weights = np.asarray(catalogue.node_incidence[candidates].sum(axis=1)).ravel()
+        candidate_items = np.asarray(catalogue.node_membership[candidates].sum(axis=1)).ravel()
+        candidate_sums = {key: snapshot.node_sums[key][candidates] for key in keys}
+        # Nodes of one tree share items only when one contains the other
+        membership = catalogue.node_membership[candidates]
+        overlaps = (membership @ membership.T).toarray() > 0
+        
+        trend = None
+        if objective == 'tracking':
+            _, headline_mom = _index_from_sums(**{key: snapshot.total_sums[key] for key in keys})
+            trend = pd.Series(headline_mom[1:]).rolling(int(trend_window)).mean().to_numpy()
+            if not np.isfinite(trend).any():
+                raise Exception(f"Need more than {trend_window} months of prices for a {trend_window}-month trend")
+        
+        def score(excluded_sums):
+            """Objective per row of (sets x months) excluded sums"""
+            _, mom = _index_from_sums(**{key: snapshot.total_sums[key] - excluded_sums[key] for key in keys})
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                if objective == 'variance':
+                    scores = np.nanvar(mom[:, 1:], axis=1)
+                else:
+                    scores = np.sqrt(np.nanmean((mom[:, 1:] - trend) ** 2, axis=1))
+            return np.where(np.isfinite(scores), scores, np.inf)
+        
+        def expand(beam):
+            """Every feasible one-node extension of the sets in the beam, with its score"""
+            sets, rows = [], []
+            for position, (chosen, weight) in enumerate(beam):
+                feasible = candidate_weights + weight <= max_excluded_weight + 1e-9
+                if chosen:
+                    feasible &= ~overlaps[list(chosen)].any(axis=0)
+                extensions = np.flatnonzero(feasible)
+                sets.append(np.full(len(extensions), position))
+                rows.append(extensions)
+            sets, rows = np.concatenate(sets), np.concatenate(rows)
+            if not len(rows):
+                return []
             
-            # Laspeyres calculation
-            weighted_sum = (month_prices[matched_items] * weights_normalized[matched_items]).sum()
-            weight_total = weights_normalized[matched_items].sum()
+            base = {key: np.array([candidate_sums[key][list(chosen)].sum(axis=0) for chosen, _ in beam])
+                    for key in keys}
+            scores = score({key: base[key][sets] + candidate_sums[key][rows] for key in keys})
+            return [
+                (tuple(sorted(beam[position][0] + (row,))), beam[position][1] + candidate_weights[row], value)
+                for position, row, value in zip(sets.tolist(), rows.tolist(), scores.tolist())
+                if np.isfinite(value)
+            ]
+        
+        no_exclusions = {key: np.zeros((1, len(snapshot.months))) for key in keys}
+        visited = {(): (0.0, float(score(no_exclusions)[0]))}
+        beam = [((), 0.0)]
+        for _ in range(int(max_exclusions)):
+            expansions = {}
+            for chosen, weight, value in expand(beam):
+                expansions.setdefault(chosen, (weight, value))
+            if not expansions:
+                break
+            best = sorted(expansions.items(), key=lambda entry: entry[1][1])[:int(beam_width)]
+            visited.update(best)
+            beam = [(chosen, weight) for chosen, (weight, _) in best]
+        
+        sets = list(visited.keys())
+        weights = np.array([visited[chosen][0] for chosen in sets])
+        scores = np.array([visited[chosen][1] for chosen in sets])
+        # Frontier: sets not beaten on both score and weight, found by sweeping in weight order
+        order = np.lexsort((scores, weights))
+        frontier = np.zeros(len(sets), dtype=bool)
+        frontier[order] = scores[order] < np.minimum.accumulate(np.r_[np.inf, scores[order][:-1]])
+        
+        def scenario(chosen):
+            selection = {}
+            for row in chosen:
+                level, code = catalogue.node_keys[candidates[row]]
+                selection.setdefault(EXCLUSION_ARGUMENTS[level], []).append(code)
+            return selection
+        
+        frame = pd.DataFrame({
+            'Size': [len(chosen) for chosen in sets],
+            'Codes': [[catalogue.node_keys[candidates[row]][1] for row in chosen] for chosen in sets],
+            'Names': [[catalogue.node_names[candidates[row]] for row in chosen] for chosen in sets],
+            'Excluded_Weight': weights,
+            'Items_Count': [catalogue.n_items - int(candidate_items[list(chosen)].sum()) for chosen in sets],
+            'Score': scores,
+            'Frontier': frontier,
+            'Scenario': [scenario(chosen) for chosen in sets],
+        })
+        frame = frame.sort_values(['Score', 'Excluded_Weight'], kind='stable').reset_index(drop=True)
+        frame.insert(0, 'Rank', np.arange(1, len(frame) + 1))
+        return frame
+    
+    def contributions(self, level: str = 'item', measure: str = 'yoy',
+                      excluded_divisions: List[str] = None, excluded_groups: List[str] = None,
+                      excluded_classes: List[str] = None, excluded_subclasses: List[str] = None,
+                      excluded_items: List[str] = None, top_k: int = None,
+                      largest: bool = True) -> pd.DataFrame:
+        """
+        Percentage-point contribution of each item or node to the index change
+        
+        With index I_t = 100 x Σ w_i P_it / W_t, item i's share of the level
+        is s_it = 100 x w_i P_it / W_t, and its contribution to the change
+        from month t-k is (s_it - s_i,t-k) / I_t-k x 100. Contributions add
+        up exactly to the headline (or exclusion variant) MoM/YoY change, and
+        node contributions are sums over their items.
+        
+        Args:
+            level: 'item', 'division', 'group', 'class' or 'subclass'
+            measure: 'mom' or 'yoy' (lag by calendar month)
+            excluded_divisions ... excluded_items: Exclusions defining the
+                variant, as in get_index_with_exclusions
+            top_k: Keep only the k largest (or smallest) contributors per month
+            largest: With top_k, True for the biggest upward contributors and
+                False for the biggest downward ones
+        
+        Returns:
+            Tidy DataFrame with columns Level, Code, Name, Weight, Month and
+            Contribution_pp (plus Rank with top_k)
+        """
+        months_back = {'mom': 1, 'yoy': 12}.get(str(measure).lower())
+        if months_back is None:
+            raise Exception(f"Unknown measure: {measure} (use 'mom' or 'yoy')")
+        if level not in ['item'] + HIERARCHY_LEVELS:
+            raise Exception(f"Unknown level: {level}")
+        snapshot = self._snapshot
+        if not snapshot.has_prices:
+            return None
+        
+        catalogue = self.catalogue
+        excluded = ~self._basket_mask(
+            excluded_divisions, excluded_groups, excluded_classes, excluded_subclasses, excluded_items
+        )
+        weights = np.where(excluded, 0.0, catalogue.item_weights)
+        weight_total = weights @ snapshot.available
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shares = weights[:, np.newaxis] * snapshot.values / weight_total * 100
+        index = np.where(~excluded @ snapshot.available > 0, shares.sum(axis=0), np.nan)
+        
+        ordinals = _month_ordinals(snapshot.months)
+        lag_columns = pd.Index(ordinals).get_indexer(ordinals - months_back)
+        valid = (lag_columns >= 0) & np.isfinite(index)
+        lag_columns = np.maximum(lag_columns, 0)
+        valid &= np.isfinite(index[lag_columns])
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            item_contributions = (shares - shares[:, lag_columns]) / index[lag_columns] * 100
+        item_contributions[:, ~valid] = np.nan
+        
+        if level == 'item':
+            contributions = item_contributions
+            rows = pd.DataFrame({
+                'Level': 'item', 'Code': catalogue.item_codes,
+                'Name': self.items_df['Item_Name'].to_numpy(), 'Weight': weights,
+            })
+        else:
+            node_ids = [node_id for node_id, (node_level, _) in enumerate(catalogue.node_keys) if node_level == level]
+            contributions = catalogue.node_membership[node_ids] @ item_contributions
+            rows = pd.DataFrame({
+                'Level': level,
+                'Code': [catalogue.node_keys[node_id][1] for node_id in node_ids],
+                'Name': [catalogue.node_names[node_id] for node_id in node_ids],
+                'Weight': catalogue.node_incidence[node_ids] @ np.where(excluded, 0.0, 1.0),
+            })
+        
+        months = np.asarray(snapshot.months, dtype=object)[valid]
+        contributions = contributions[:, valid]
+        
+        if top_k is not None:
+            if int(top_k) < 1:
+                raise Exception(f"top_k must be at least 1, got {top_k}")
+            k = min(int(top_k), len(rows))
+            ranking = -contributions if largest else contributions.copy()
+            ranking[np.isnan(ranking)] = np.inf
+            top = np.argpartition(ranking, k - 1, axis=0)[:k] if k < len(rows) else np.argsort(ranking, axis=0)
+            top = np.take_along_axis(top, np.argsort(np.take_along_axis(ranking, top, axis=0), axis=0), axis=0)
             
-            if weight_total > 0:
-                index_value = weighted_sum / weight_total * 100
-            else:
-                index_value = 100.0
+            frame = rows.iloc[top.T.ravel()].reset_index(drop=True)
+            frame['Month'] = np.repeat(months, k)
+            frame['Rank'] = np.tile(np.arange(1, k + 1), len(months))
+            frame['Contribution_pp'] = np.take_along_axis(contributions, top, axis=0).T.ravel()
+            return frame
+        
+        frame = rows.iloc[np.repeat(np.arange(len(rows)), len(months))].reset_index(drop=True)
+        frame['Month'] = np.tile(months, len(rows))
+        frame['Contribution_pp'] = contributions.ravel()
+        return frame
+    
+    def get_node_indices(self, levels: List[str] = None, store: PriceTensorStore = None) -> pd.DataFrame:
+        """
+        Index of every hierarchy node for every month
+        
+        With a store, all states and sectors are stacked into the columns of
+        a single sparse product with the item -> node incidence matrix;
+        otherwise the precomputed node sums of the loaded prices are used.
+        
+        Args:
+            levels: Levels to return ('division', 'group', 'class',
+                'subclass'); default all
+            store: Optional PriceTensorStore for all states and sectors
+        
+        Returns:
+            Tidy DataFrame with columns Level, Code, Name, Month, Index and
+            MoM_Change_% (plus State and Sector with a store)
+        """
+        catalogue = self.catalogue
+        levels = levels or HIERARCHY_LEVELS
+        node_ids = np.array([
+            node_id for node_id, (level, _) in enumerate(catalogue.node_keys) if level in levels
+        ], dtype=int)
+        
+        if store is None:
+            snapshot = self._snapshot
+            if not snapshot.has_prices:
+                return None
+            sums = {key: snapshot.node_sums[key][node_ids] for key in ('weighted_sum', 'weight_total', 'price_count')}
+            months, axes = snapshot.months, {}
+        else:
+            values, available = store.aligned(catalogue.item_codes)
+            panel_shape = values.shape[:2] + values.shape[3:]
+            # (states, sectors, items, months) -> items x (states * sectors * months)
+            stacked = [np.moveaxis(array, 2, 0).reshape(catalogue.n_items, -1) for array in (values, available)]
+            _, node_sums = self._partial_sums(*stacked)
+            sums = {
+                key: node_sums[key][node_ids].reshape((len(node_ids),) + panel_shape)
+                for key in ('weighted_sum', 'weight_total', 'price_count')
+            }
+            months = store.labels['month']
+            axes = {'State': store.labels['state'], 'Sector': store.labels['sector']}
+        
+        index, mom = _index_from_sums(**sums)
+        
+        nodes = pd.DataFrame({
+            'Level': [catalogue.node_keys[node_id][0] for node_id in node_ids],
+            'Code': [catalogue.node_keys[node_id][1] for node_id in node_ids],
+            'Name': [catalogue.node_names[node_id] for node_id in node_ids],
+        })
+        grid = pd.MultiIndex.from_product(
+            [range(len(node_ids)), *axes.values(), months], names=['Node', *axes.keys(), 'Month']
+        ).to_frame(index=False)
+        frame = nodes.iloc[grid.pop('Node')].reset_index(drop=True).join(grid)
+        frame['Index'] = index.ravel()
+        frame['MoM_Change_%'] = mom.ravel()
+        
+        return frame.dropna(subset=['Index']).reset_index(drop=True)
+    
+    def reconcile_published(self, published: pd.DataFrame, tolerance: float = 0.05) -> pd.DataFrame:
+        """
+        Re-aggregate published item indices and compare with published aggregates
+        
+        Item indices are pivoted to an items x periods matrix (one period per
+        state, sector, year and month) and every division, group, class,
+        subclass and the general index are recomputed with the weights in one
+        sparse product, then joined back to the published rows.
+        
+        Args:
+            published: Published rows in the scraper layout (state, sector,
+                year, month, code, index), e.g. analysis/scraped_cpi.csv;
+                code '*' is the general index
+            tolerance: Largest absolute deviation (index points) accepted
+        
+        Returns:
+            One row per published aggregate with Level, Code, Name, State,
+            Sector, Year, Month, Published, Recomputed, Deviation,
+            Abs_Deviation, Rel_Deviation_%, Items_Priced and Within_Tolerance,
+            largest absolute deviation first
+        """
+        catalogue = self.catalogue
+        period_columns = ['state', 'sector', 'year', 'month']
+        
+        try:
+            codes = published['code'].astype(str).str.strip().to_numpy()
+            values = pd.to_numeric(published['index'], errors='coerce').to_numpy(dtype=float)
+            period_ids, periods = pd.factorize(pd.MultiIndex.from_frame(published[period_columns]))
+        except KeyError as e:
+            raise Exception(f"Published data is missing column {e}")
+        
+        # Items x periods matrix of published item indices
+        item_rows = np.array([catalogue.item_ids.get(code, -1) for code in codes])
+        is_item = (item_rows >= 0) & np.isfinite(values)
+        item_index = np.zeros((catalogue.n_items, len(periods)))
+        item_available = np.zeros((catalogue.n_items, len(periods)))
+        item_index[item_rows[is_item], period_ids[is_item]] = values[is_item]
+        item_available[item_rows[is_item], period_ids[is_item]] = 1.0
+        
+        totals, node_sums = self._partial_sums(item_index, item_available)
+        
+        # Headline appended as the last row, after every node
+        weighted_sum = np.vstack([node_sums['weighted_sum'], totals['weighted_sum']])
+        weight_total = np.vstack([node_sums['weight_total'], totals['weight_total']])
+        priced = np.vstack([node_sums['price_count'], totals['price_count']])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            recomputed = np.where(weight_total > 0, weighted_sum / weight_total, np.nan)
+        
+        node_rows = catalogue.nodes_for_published_codes(codes)
+        node_rows[codes == '*'] = catalogue.n_nodes
+        keep = (node_rows >= 0) & np.isfinite(values)
+        node_rows, row_periods = node_rows[keep], period_ids[keep]
+        
+        levels = np.array([level for level, _ in catalogue.node_keys] + ['general'], dtype=object)
+        node_codes = np.array([code for _, code in catalogue.node_keys] + ['*'], dtype=object)
+        node_names = np.array(list(catalogue.node_names) + ['CPI (General)'], dtype=object)
+        
+        report = pd.DataFrame({
+            'Level': levels[node_rows],
+            'Code': node_codes[node_rows],
+            'Name': node_names[node_rows],
+            **{column.title(): published[column].to_numpy()[keep] for column in period_columns},
+            'Published': values[keep],
+            'Recomputed': recomputed[node_rows, row_periods],
+        })
+        report['Deviation'] = report['Recomputed'] - report['Published']
+        report['Abs_Deviation'] = report['Deviation'].abs()
+        report['Rel_Deviation_%'] = report['Deviation'] / report['Published'] * 100
+        report['Items_Priced'] = priced[node_rows, row_periods].astype(int)
+        report['Within_Tolerance'] = report['Abs_Deviation'] <= tolerance
+        
+        return report.sort_values('Abs_Deviation', ascending=False, kind='stable').reset_index(drop=True)
+    
+    def impute_missing(self, methods: List[str] = ('parent',), store: PriceTensorStore = None,
+                       apply: bool = True) -> Dict:
+        """
+        Impute missing price relatives before aggregation (see price_imputation)
+        
+        Without imputation an item with no price in a month simply drops out
+        of that month's index, so the basket changes month to month. Without
+        a store the loaded price matrix is imputed and, with apply, swapped
+        in as a new snapshot, so every index after this uses the fixed
+        basket. With a store every state, sector and month is imputed in one
+        pass and returned without touching the engine.
+        
+        Args:
+            methods: Methods from IMPUTATION_METHODS, applied in order
+                ('donor' needs a store)
+            store: Optional PriceTensorStore to impute instead
+            apply: Install the imputed matrix (loaded prices only)
+        
+        Returns:
+            Dict with 'values', 'available' and 'imputed' arrays (see
+            impute_prices) and 'counts', a DataFrame of imputed cells per
+            month and method
+        """
+        def impute(values, available, months):
+            values, available, imputed = impute_prices(values, available, self.catalogue, list(methods))
+            return {
+                'values': values,
+                'available': available,
+                'imputed': imputed,
+                'counts': imputation_counts(imputed, available, months),
+            }
+        
+        if store is not None:
+            values, available = store.aligned(self.catalogue.item_codes)
+            return impute(values, available, store.labels['month'])
+        
+        # Read, impute and install under the write lock, so a reload or
+        # append_month landing in between is not overwritten by the imputed
+        # copy of the older prices
+        with self._write_lock:
+            snapshot = self._snapshot
+            if not snapshot.has_prices:
+                raise Exception("Load prices before imputing")
+            months = snapshot.months
+            result = impute(snapshot.values, snapshot.available > 0, months)
             
-            monthly_data.append({
-                'Month': month,
-                'Index': float(index_value)
-            })
+            if apply:
+                values, available = result['values'], result['available']
+                filled = pd.DataFrame(np.where(available, values, np.nan), index=self.catalogue.item_codes, columns=months)
+                prices_df = snapshot.prices_df.copy()
+                for month in months:
+                    prices_df[month] = prices_df['Item_Code'].map(filled[month]).fillna(prices_df[month])
+                self._install_prices(
+                    prices_df, months, values, available.astype(float), snapshot.price_rows | available.any(axis=1)
+                )
+        return result
+    
+    def _build_price_matrix(self, prices_df: pd.DataFrame,
+                            months: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Align price relatives to items_df as items x months value/availability matrices
         
-        # Calculate MoM changes
-        for i, data in enumerate(monthly_data):
-            if i > 0:
-                prev_index = monthly_data[i-1]['Index']
-                mom_change = ((data['Index'] - prev_index) / prev_index) * 100
-                data['MoM_Change_%'] = float(mom_change)
-            else:
-                data['MoM_Change_%'] = 0.0
-        
-        result = {
-            'Variant': variant_name,
-            'Items_Count': len(items_data),
-            'Total_Weight': float(weight_sum),
-            'Weight_Normalized': float(weight_sum / weight_sum * 100),  # Should be 100
-            'Monthly_Data': monthly_data
+        Both matrices get APPEND_HEADROOM spare columns past the months, so
+        append_month can grow them without copying.
+        """
+        item_codes = self.items_df['Item_Code']
+        prices = prices_df.drop_duplicates('Item_Code').set_index('Item_Code')
+        
+        matrix = prices[months].reindex(item_codes).to_numpy(dtype=float)
+        values = np.zeros((matrix.shape[0], len(months) + APPEND_HEADROOM))
+        available = np.zeros(values.shape)
+        priced = np.isfinite(matrix)
+        values[:, :len(months)] = np.where(priced, matrix, 0.0)
+        available[:, :len(months)] = priced
+        
+        return values, available, item_codes.isin(prices.index).to_numpy()
+    
+    def _install_prices(self, prices_df: pd.DataFrame, months: List[str], values: np.ndarray,
+                        available: np.ndarray, price_rows: np.ndarray):
+        """
+        Build a snapshot for an aligned items x months price matrix and swap it in
+        
+        values and available may have spare columns past the months, which
+        append_month fills before it has to reallocate.
+        """
+        # Availability is kept as float, so the sums multiply it without a cast per call
+        available = np.asarray(available, dtype=float)
+        with self._write_lock:
+            # Column buffers leave room for append_month to grow without copying
+            value_buffer = _ColumnBuffer(values, len(months))
+            available_buffer = _ColumnBuffer(available, len(months))
+            values, available = value_buffer.array, available_buffer.array
+            
+            total_sums, node_sums = self._partial_sums(values, available)
+            total_buffers = {key: _ColumnBuffer(sums[np.newaxis, :]) for key, sums in total_sums.items()}
+            node_buffers = {key: _ColumnBuffer(sums) for key, sums in node_sums.items()}
+            self._add_price_row_counts(total_sums, node_sums, price_rows)
+            snapshot = PriceSnapshot(
+                next(self._versions), self.catalogue, prices_df, months,
+                values, available, price_rows, total_sums, node_sums
+            )
+            
+            self._value_buffer, self._available_buffer = value_buffer, available_buffer
+            self._total_buffers, self._node_buffers = total_buffers, node_buffers
+            self._snapshot = snapshot
+            self.clear_cache()
+    
+    def _partial_sums(self, values: np.ndarray, available: np.ndarray) -> Tuple[Dict, Dict]:
+        """
+        Headline and node sums for the given (items x columns) price arrays
+        
+        Each entry is an array of Σ(weight x price), Σ(weight) and the count
+        of priced items per column, so exclusions are answered by subtracting
+        a few node rows. Node sums for all hierarchy levels come from one
+        sparse product with the catalogue's nodes x items incidence matrices.
+        """
+        catalogue = self.catalogue
+        available = np.asarray(available, dtype=float)
+        
+        total_sums = {
+            'weighted_sum': catalogue.item_weights @ values,
+            'weight_total': catalogue.item_weights @ available,
+            'price_count': available.sum(axis=0),
         }
+        node_sums = {
+            'weighted_sum': catalogue.node_incidence @ values,
+            'weight_total': catalogue.node_incidence @ available,
+            'price_count': catalogue.node_membership @ available,
+        }
+        return total_sums, node_sums
+    
+    def _add_price_row_counts(self, total_sums: Dict, node_sums: Dict, price_rows: np.ndarray):
+        """Count items with a price row, in total and per node"""
+        total_sums['price_rows'] = int(price_rows.sum())
+        node_sums['price_rows'] = self.catalogue.node_membership @ price_rows.astype(float)
+    
+    def append_month(self, month: str, relatives) -> Dict:
+        """
+        Add one month of price relatives without recomputing earlier months
         
-        return result
+        The price matrix and the headline and node partial sums grow in place
+        (amortized doubling) past the columns earlier snapshots can see, and
+        cached results and the returned measures are computed for the new
+        month only, so an append costs O(items), not O(items x months). The
+        price table is not copied; prices_df fills in appended months when
+        read. The result is swapped in as a new snapshot.
+        
+        Args:
+            month: Month label (or date) later than every loaded month by
+                calendar month (e.g. '2026-01')
+            relatives: Price relatives for the month, as a Series or dict keyed
+                by Item_Code, or an array aligned with items_df. Items that are
+                missing or NaN have no price for the month; at least one item
+                must be priced.
+        
+        Returns:
+            Dict with the new month's headline Index, MoM_Change_% and the
+            PERIOD_MEASURES (None where the months they need are not loaded)
+        """
+        if isinstance(relatives, dict):
+            relatives = pd.Series(relatives)
+        if isinstance(relatives, pd.Series):
+            column = relatives.reindex(self.catalogue.item_codes).to_numpy(dtype=float)
+        else:
+            column = np.asarray(relatives, dtype=float)
+            if column.shape != (self.catalogue.n_items,):
+                raise Exception(f"Expected {self.catalogue.n_items} relatives, got {column.shape}")
+        
+        available = np.isfinite(column)
+        if not available.any():
+            raise Exception(f"No priced items for {month}; nothing to append")
+        value_column = np.where(available, column, 0.0)
+        available_column = available.astype(float)
+        month = month_label(month)
+        if _month_ordinal(month) is None:
+            raise Exception(f"Month {month} is not a YYYY-MM month")
+        
+        with self._write_lock:
+            previous = self._snapshot
+            if not previous.has_prices:
+                raise Exception("Load prices before appending a month")
+            # Ordered by calendar month, so 'Price_Relative_2026-01' is followed by '2026-02'
+            last = _month_ordinal(previous.months[-1])
+            if last is None or _month_ordinal(month) <= last:
+                raise Exception(f"Month {month} must be later than {previous.months[-1]}")
+            
+            self._value_buffer.append(value_column)
+            self._available_buffer.append(available_column)
+            
+            new_totals, new_nodes = self._partial_sums(
+                value_column[:, np.newaxis], available_column[:, np.newaxis]
+            )
+            for key in new_totals:
+                self._total_buffers[key].append(new_totals[key])
+                self._node_buffers[key].append(new_nodes[key][:, 0])
+            total_sums = {key: buffer.array[0] for key, buffer in self._total_buffers.items()}
+            node_sums = {key: buffer.array for key, buffer in self._node_buffers.items()}
+            
+            price_rows = previous.price_rows | available
+            if (price_rows != previous.price_rows).any():
+                self._add_price_row_counts(total_sums, node_sums, price_rows)
+            else:
+                total_sums['price_rows'] = previous.total_sums['price_rows']
+                node_sums['price_rows'] = previous.node_sums['price_rows']
+            
+            snapshot = PriceSnapshot(
+                next(self._versions), self.catalogue, previous._source_prices, previous.months + [month],
+                self._value_buffer.array, self._available_buffer.array, price_rows, total_sums, node_sums,
+                source_months=previous._source_months
+            )
+            
+            self._extend_cached_results(previous, snapshot)
+            self._snapshot = snapshot
+        
+        return self._latest_headline_changes(snapshot)
     
-    def get_comparison(self, headline: Dict, current: Dict) -> pd.DataFrame:
-        """Create comparison dataframe"""
-        if not headline or not current:
+    def _latest_headline_changes(self, snapshot: PriceSnapshot) -> Dict:
+        """Headline index, MoM and period measures for the snapshot's last month"""
+        # Trailing months the measures need, plus the last earlier month with prices for MoM
+        start = max(len(snapshot.months) - (MEASURE_LOOKBACK + 1), 0)
+        earlier = np.flatnonzero(snapshot.total_sums['price_count'][:start] > 0)[-1:]
+        columns = np.r_[earlier, np.arange(start, len(snapshot.months))]
+        
+        index, mom = _index_from_sums(**{
+            key: snapshot.total_sums[key][columns]
+            for key in ('weighted_sum', 'weight_total', 'price_count')
+        })
+        months = [snapshot.months[column] for column in columns]
+        measures = _latest_period_measures(months, index)
+        
+        return {
+            'Month': months[-1],
+            'Index': float(index[-1]),
+            'MoM_Change_%': float(mom[-1]),
+            **{name: _optional_float(value) for name, value in zip(PERIOD_MEASURES, measures)}
+        }
+    
+    def _calculate_laspeyres(self, item_codes: List[str], variant_name: str) -> Dict:
+        """
+        Calculate Laspeyres index
+        Formula: L = SUM(P_t / P_0 * W) / SUM(W) * 100
+        """
+        snapshot = self._snapshot
+        if not item_codes or not snapshot.has_prices:
             return None
         
-        comparison = []
+        mask = self.catalogue.item_mask(item_codes)
+        
+        if not mask.any() or not snapshot.price_rows[mask].any():
+            return None
         
-        for i, month in enumerate(self.months):
-            headline_idx = headline['Monthly_Data'][i]['Index'] if i < len(headline['Monthly_Data']) else None
-            current_idx = current['Monthly_Data'][i]['Index'] if i < len(current['Monthly_Data']) else None
+        def compute():
+            index, mom = _laspeyres_kernel(
+                snapshot.values, snapshot.available, mask[np.newaxis, :],
+                self.catalogue.item_weights
+            )
+            weight_sum = self.catalogue.item_weights[mask].sum()
             
-            if headline_idx is None or current_idx is None:
-                continue
+            return _series_result(variant_name, snapshot.months, index[0], mom[0], int(mask.sum()), weight_sum)
+        
+        return self._cached(snapshot, ('items', self.catalogue.mask_key(mask), variant_name), compute)
+    
+    # =========================================================================
+    # RESULT CACHE
+    # =========================================================================
+    
+    def _cached(self, snapshot: PriceSnapshot, key: Tuple[Hashable, ...],
+                compute: Callable[[], Dict]) -> Dict:
+        """
+        Return a cached result for key, computing and storing it on a miss
+        
+        Keys are prefixed with the snapshot's price version so entries from
+        another load can never be served, and a result computed on a snapshot
+        that has since been replaced is returned but not stored. Callers get
+        a copy, so mutating a returned result does not touch the cached one.
+        """
+        key = (snapshot.version,) + key
+        
+        with self._cache_lock:
+            if key in self._result_cache:
+                self._result_cache.move_to_end(key)
+                self._cache_stats['hits'] += 1
+                return _copy_result(self._result_cache[key])
+            self._cache_stats['misses'] += 1
+        
+        result = compute()
+        
+        if self.cache_size > 0:
+            with self._cache_lock:
+                if snapshot is self._snapshot:
+                    self._result_cache[key] = result
+                    self._result_cache.move_to_end(key)
+                    while len(self._result_cache) > self.cache_size:
+                        self._result_cache.popitem(last=False)
+                        self._cache_stats['evictions'] += 1
+        
+        return _copy_result(result)
+    
+    def clear_cache(self):
+        """Drop all cached results"""
+        with self._cache_lock:
+            self._result_cache.clear()
+    
+    def _extend_cached_results(self, previous: PriceSnapshot, snapshot: PriceSnapshot):
+        """
+        Carry cached results over to a new snapshot after append_month
+        
+        Each cached series gains the newest month, computed from that
+        selection's sums for the new column only. Empty (None) results are
+        dropped since the new month may give their items a price.
+        """
+        with self._cache_lock:
+            entries = list(self._result_cache.items())
+            self._result_cache.clear()
             
-            comparison.append({
-                'Month': month,
-                'Headline': round(headline_idx, 2),
-                'Current': round(current_idx, 2),
-                'Difference': round(current_idx - headline_idx, 2),
-                'Difference_%': round(((current_idx - headline_idx) / headline_idx) * 100, 3)
-            })
+            for key, result in entries:
+                if result is None or key[0] != previous.version:
+                    continue
+                kind = key[1]
+                if kind in ('items', 'basket'):
+                    mask = np.unpackbits(
+                        np.frombuffer(key[2], dtype=np.uint8), count=self.catalogue.n_items
+                    ).astype(bool)
+                    weights = np.where(mask, self.catalogue.item_weights, 0.0)
+                    sums = {
+                        'weighted_sum': weights @ snapshot.values[:, -1],
+                        'weight_total': weights @ snapshot.available[:, -1],
+                        'price_count': mask.astype(float) @ snapshot.available[:, -1],
+                    }
+                else:
+                    sums = {
+                        name: snapshot.total_sums[name][-1]
+                        for name in ('weighted_sum', 'weight_total', 'price_count')
+                    }
+                
+                extended = result
+                if sums['price_count'] > 0:
+                    index = sums['weighted_sum'] / sums['weight_total'] * 100 if sums['weight_total'] > 0 else 100.0
+                    previous_index = result.index[-1] if len(result.index) else np.nan
+                    mom = (index - previous_index) / previous_index * 100 if len(result.index) else 0.0
+                    measures = _latest_period_measures(
+                        list(result.months[-MEASURE_LOOKBACK:]) + [snapshot.months[-1]],
+                        np.append(result.index[-MEASURE_LOOKBACK:], index)
+                    )
+                    extended = result.appended(snapshot.months[-1], index, mom, measures)
+                
+                self._result_cache[(snapshot.version,) + key[1:]] = extended
+    
+    def cache_info(self) -> Dict:
+        """Cache hit/miss/eviction counters and current size"""
+        with self._cache_lock:
+            return {
+                **self._cache_stats,
+                'size': len(self._result_cache),
+                'max_size': self.cache_size,
+                'price_version': self._snapshot.version,
+            }
+    
+    def get_comparison(self, headline: CPIResult, current: CPIResult) -> pd.DataFrame:
+        """Create comparison dataframe (months present in both results)"""
+        if not headline or not current:
+            return None
+        
+        comparison = self.compare_variants(headline, {'Current': current}).dropna(subset=['Index'])
+        return pd.DataFrame({
+            'Month': comparison['Month'].to_numpy(),
+            'Headline': np.round(comparison['Baseline'].to_numpy(), 2),
+            'Current': np.round(comparison['Index'].to_numpy(), 2),
+            'Difference': np.round(comparison['Difference'].to_numpy(), 2),
+            'Difference_%': np.round(comparison['Difference_%'].to_numpy(), 3),
+        })
+    
+    def compare_variants(self, baseline: CPIResult, variants, output: str = 'long'):
+        """
+        Compare N variants against one baseline on aligned months
+        
+        Every series is placed on the baseline's months by label (NaN where a
+        variant has no value), so levels, differences and percent differences
+        are (variants x months) array operations.
+        
+        Args:
+            baseline: Result to compare against (e.g. the headline index)
+            variants: Dict of name -> CPIResult, or a CPIBatchResult. Variants
+                that calculated to None (e.g. nothing left to price) are
+                skipped with a warning
+            output: 'long' (one row per variant and month), 'wide' (months as
+                rows, (measure, variant) columns) or 'arrays'
+        
+        Returns:
+            DataFrame with Variant, Month, Baseline, Index, Difference and
+            Difference_% for 'long'; Index, Difference and Difference_% blocks
+            plus a Baseline column for 'wide'; for 'arrays' a dict of the
+            month and variant labels and the matrices under the same names
+        """
+        if output not in ('long', 'wide', 'arrays'):
+            raise Exception(f"Unknown comparison output: {output}")
+        if baseline is None:
+            raise Exception("No baseline result to compare against")
+        
+        months = baseline.months
+        base = baseline.index
+        if isinstance(variants, CPIBatchResult):
+            names = variants.variants
+            positions = pd.Index(variants.months).get_indexer(list(months))
+            levels = np.where(positions >= 0, variants.index[:, positions], np.nan)
+        else:
+            missing = [name for name, result in variants.items() if result is None]
+            if missing:
+                warnings.warn(f"Skipping variants with no result: {', '.join(map(str, missing))}")
+            names = [name for name, result in variants.items() if result is not None]
+            levels = np.array([variants[name].index_on(months) for name in names]).reshape(len(names), len(months))
+        
+        difference = levels - base
+        with np.errstate(divide='ignore', invalid='ignore'):
+            difference_pct = difference / base * 100
+        
+        if output == 'arrays':
+            return {
+                'Month': months, 'Variant': names, 'Baseline': base,
+                'Index': levels, 'Difference': difference, 'Difference_%': difference_pct,
+            }
+        
+        if output == 'wide':
+            blocks = {'Index': levels, 'Difference': difference, 'Difference_%': difference_pct}
+            frame = pd.concat(
+                {measure: pd.DataFrame(values.T, index=pd.Index(months, name='Month'), columns=names)
+                 for measure, values in blocks.items()},
+                axis=1
+            )
+            frame.insert(0, ('Baseline', baseline.variant), base)
+            return frame
         
-        return pd.DataFrame(comparison)
+        return pd.DataFrame({
+            'Variant': np.repeat(np.asarray(names, dtype=object), len(months)),
+            'Month': np.tile(months, len(names)),
+            'Baseline': np.tile(base, len(names)),
+            'Index': levels.ravel(),
+            'Difference': difference.ravel(),
+            'Difference_%': difference_pct.ravel(),
+        })
     
     def calculate_custom_index(self, index_configs: List[Dict]) -> Dict:
         """
@@ -288,31 +1859,14 @@ class CPIEngine:
         indices_data = []
         
         for idx_config in index_configs:
-            # Validate required fields
-            if not isinstance(idx_config.get('name'), str) or not idx_config['name'].strip():
-                validation_errors.append("Missing or invalid index name")
-                continue
-            
-            try:
-                value = float(idx_config['value'])
-                weight = float(idx_config['weight'])
-            except (ValueError, TypeError):
-                validation_errors.append(f"Invalid values for {idx_config['name']}: must be numbers")
-                continue
-            
-            if value <= 0:
-                validation_errors.append(f"{idx_config['name']}: Index value must be positive")
-                continue
-            
-            if weight < 0:
-                validation_errors.append(f"{idx_config['name']}: Weight cannot be negative")
+            entry, error = _parse_custom_entry(idx_config)
+            if error:
+                validation_errors.append(error)
                 continue
             
-            total_weight += weight
+            total_weight += entry['weight']
             indices_data.append({
-                'name': idx_config['name'].strip(),
-                'value': value,
-                'weight': weight,
+                **entry,
                 'contribution': 0.0  # Will be calculated after normalization
             })
         
@@ -331,9 +1885,7 @@ class CPIEngine:
             }
         
         # Normalize weights to sum to 100
-        weight_imbalance = False
-        if abs(total_weight - 100.0) > 0.01:  # Allow small rounding errors
-            weight_imbalance = True
+        weight_imbalance = bool(_weight_imbalance(total_weight))
         
         # Calculate contributions and weighted average
         weighted_sum = 0.0
@@ -357,6 +1909,95 @@ class CPIEngine:
             'errors': []
         }
     
+    def calculate_custom_index_series(self, components, blends: Dict[str, List[Dict]]) -> Dict:
+        """
+        Blend whole component series with many weight specs at once
+        
+        Companion to calculate_custom_index: each blend lists components with
+        weights, validated and normalized to 100 the same way, but 'value' is
+        replaced by a component series. All blends are one (blends x
+        components) matrix product over the stacked series.
+        
+        Args:
+            components: Dict of component name -> array (..., T), e.g. states
+                x months, or a DataFrame with one column per component
+            blends: Dict of blend name -> list of {'name', 'weight'} entries,
+                e.g. {'60/40': [{'name': 'Urban', 'weight': 60},
+                                {'name': 'Rural', 'weight': 40}]}
+        
+        Returns:
+            Dict with weighted_average ((blends, ..., T) array, or a DataFrame
+            with one column per blend for DataFrame input), the blend names,
+            normalized_weights (blends x components), total_weight_original,
+            weight_imbalance, success and errors. Invalid blends, and cells
+            where a used component is not a positive number, are NaN.
+        """
+        if not blends:
+            return None
+        
+        frame_index = None
+        if isinstance(components, pd.DataFrame):
+            frame_index = components.index
+            components = {name: components[name].to_numpy(dtype=float) for name in components.columns}
+        
+        component_names = list(components.keys())
+        positions = {name: pos for pos, name in enumerate(component_names)}
+        try:
+            stacked = np.stack(np.broadcast_arrays(*[np.asarray(components[name], dtype=float)
+                                                     for name in component_names]))
+        except (ValueError, TypeError) as e:
+            return {'success': False, 'errors': [f'Invalid component series: {e}'], 'blends': []}
+        
+        blend_names = list(blends.keys())
+        weights = np.zeros((len(blend_names), len(component_names)))
+        valid = np.ones(len(blend_names), dtype=bool)
+        errors = []
+        for row, blend in enumerate(blend_names):
+            for idx_config in blends[blend]:
+                entry, error = _parse_custom_entry(idx_config, require_value=False)
+                if error is None and entry['name'] not in positions:
+                    error = f"{entry['name']}: Unknown component"
+                if error:
+                    errors.append(f"{blend}: {error}")
+                    valid[row] = False
+                    continue
+                weights[row, positions[entry['name']]] += entry['weight']
+        
+        totals = weights.sum(axis=1)
+        for row in np.flatnonzero(valid & (totals == 0)):
+            errors.append(f"{blend_names[row]}: Total weight is zero")
+        valid &= totals > 0
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalized = np.where(valid[:, np.newaxis], weights / totals[:, np.newaxis] * 100, np.nan)
+        
+        # Components used by a valid blend must be positive wherever it is evaluated;
+        # components no valid blend uses may hold anything
+        bad_cells = ~(stacked > 0)
+        used = (weights > 0) & valid[:, np.newaxis]
+        used_bad_cells = int(bad_cells[used.any(axis=0)].sum())
+        if used_bad_cells:
+            errors.append(f"Component values must be positive ({used_bad_cells} cells); affected blend cells are NaN")
+        series_shape = stacked.shape[1:]
+        flat = np.where(bad_cells, 0.0, stacked).reshape(len(component_names), -1)
+        used_bad = used.astype(float) @ bad_cells.reshape(len(component_names), -1)
+        
+        average = np.where(valid[:, np.newaxis], np.nan_to_num(normalized) @ flat / 100, np.nan)
+        average = np.where(used_bad > 0, np.nan, average).reshape((len(blend_names),) + series_shape)
+        
+        if frame_index is not None:
+            average = pd.DataFrame(average.T, index=frame_index, columns=blend_names)
+        
+        return {
+            'success': not errors,
+            'blends': blend_names,
+            'weighted_average': average,
+            'normalized_weights': normalized,
+            'total_weight_original': totals,
+            'weight_imbalance': _weight_imbalance(totals),
+            'errors': errors
+        }
+    
     def validate_custom_indices(self, index_configs: List[Dict]) -> Tuple[bool, List[str]]:
         """Validate custom index configurations"""
         errors = []
@@ -464,7 +2105,7 @@ class CPIEngine:
                     'new_index': new_idx,
                     'new_weight': new_wt
                 })
-                
+            
             except (ValueError, TypeError) as e:
                 errors.append(f"Invalid values for exclusion '{excl.get('name', 'Unknown')}': {e}")
         
@@ -539,4 +2180,119 @@ class CPIEngine:
             'exclusions': valid_exclusions,
             'errors': []
         }
-
+    
+    def calculate_core_with_manual_exclusions_batch(
+        self,
+        headline_index,
+        headline_weight,
+        exclusion_index,
+        exclusion_weight,
+        months: List[str] = None,
+        lag: int = 12,
+        scenario_name: str = None
+    ) -> Dict:
+        """
+        Array version of calculate_core_with_manual_exclusions for whole series
+        
+        Applies the same formula and validation rules to every period at once:
+        CPI Ex. Items = (Headline Index × W_total - Σ(Excluded_i Index × W_i)) / (W_total - Σ W_i)
+        
+        Leading dimensions (e.g. states or scenarios) broadcast, so one call
+        covers many series.
+        
+        Args:
+            headline_index: (..., T) headline index per period
+            headline_weight: Headline total weight %, broadcastable to (..., T)
+            exclusion_index: (..., N, T) index of each excluded component
+            exclusion_weight: Weights %, broadcastable to (..., N, T);
+                components with weight <= 0 in a period are skipped there,
+                and a NaN or infinite weight fails that period
+            months: Optional YYYY-MM labels of the T axis; when given the
+                inflation lag is taken by calendar month, otherwise by position
+            lag: Periods between the old and new index (12 = YoY, 1 = MoM)
+            scenario_name: Name for this scenario
+        
+        Returns:
+            Dict with (..., T) arrays core_index, remaining_weight,
+            total_excluded_weight, excluded_items_count, headline_inflation,
+            inflation_rate and difference_from_headline (NaN where a period
+            or its lag period fails validation), the boolean valid mask, and
+            success/errors summarising the failed checks
+        """
+        try:
+            headline_index = np.asarray(headline_index, dtype=float)
+            headline_weight = np.broadcast_to(np.asarray(headline_weight, dtype=float), headline_index.shape)
+            exclusion_index = np.asarray(exclusion_index, dtype=float)
+            exclusion_weight = np.broadcast_to(np.asarray(exclusion_weight, dtype=float), exclusion_index.shape)
+            np.broadcast_shapes(headline_index.shape, exclusion_index.shape[:-2] + exclusion_index.shape[-1:])
+        except (ValueError, TypeError) as e:
+            return {
+                'success': False,
+                'errors': [f'Invalid headline or exclusion arrays: {e}'],
+                'scenario_name': scenario_name or 'Unknown'
+            }
+        
+        # Same rules as the single-period method, as per-period masks
+        checks = {}
+        checks['Invalid headline index or weight values'] = ~(np.isfinite(headline_index) & np.isfinite(headline_weight))
+        checks['Headline index values must be positive'] = ~(headline_index > 0)
+        checks['Headline weight values must be positive'] = ~(headline_weight > 0)
+        
+        # A non-finite weight is invalid, not skipped (the single-period method propagates it)
+        counted = exclusion_weight > 0
+        checks['Invalid values for exclusions'] = (
+            (counted & ~np.isfinite(exclusion_index)) | ~np.isfinite(exclusion_weight)
+        ).any(axis=-2)
+        counted &= np.isfinite(exclusion_weight)
+        weights = np.where(counted, exclusion_weight, 0.0)
+        values = np.where(counted, exclusion_index, 0.0)
+        
+        excluded_count = counted.sum(axis=-2)
+        total_excluded = weights.sum(axis=-2)
+        weighted_exclusions = (values * weights).sum(axis=-2)
+        
+        checks['No valid exclusions provided'] = excluded_count == 0
+        checks['Total excluded weight must be less than headline weight'] = ~(total_excluded < headline_weight)
+        
+        shape = np.broadcast_shapes(*(mask.shape for mask in checks.values()))
+        valid = np.ones(shape, dtype=bool)
+        errors = []
+        for message, failed in checks.items():
+            failed = np.broadcast_to(failed, shape)
+            if failed.any():
+                errors.append(f"{message} ({int(failed.sum())} of {failed.size} periods)")
+            valid &= ~failed
+        
+        remaining = headline_weight - total_excluded
+        with np.errstate(divide='ignore', invalid='ignore'):
+            core_index = np.where(valid, (headline_index * headline_weight - weighted_exclusions) / remaining, np.nan)
+        headline_valid = np.where(valid, headline_index, np.nan)
+        
+        # Old period = lag periods (or calendar months) earlier
+        if months is not None:
+            ordinals = _month_ordinals(months)
+            lag_columns = pd.Index(ordinals).get_indexer(ordinals - lag)
+        else:
+            lag_columns = np.arange(shape[-1]) - lag
+        has_lag = lag_columns >= 0
+        lag_columns = np.maximum(lag_columns, 0)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            old_core = np.where(has_lag, core_index[..., lag_columns], np.nan)
+            old_headline = np.where(has_lag, headline_valid[..., lag_columns], np.nan)
+            headline_inflation = (headline_valid - old_headline) / old_headline * 100
+            core_inflation = (core_index - old_core) / old_core * 100
+        
+        return {
+            'success': bool(valid.all()),
+            'scenario_name': scenario_name or 'CPI Ex. Items',
+            'valid': valid,
+            'core_index': core_index,
+            'remaining_weight': np.where(valid, remaining, np.nan),
+            'total_excluded_weight': np.where(valid, total_excluded, np.nan),
+            'excluded_items_count': excluded_count,
+            'headline_inflation': headline_inflation,
+            'inflation_rate': core_inflation,
+            'difference_from_headline': core_inflation - headline_inflation,
+            'errors': errors
+        }
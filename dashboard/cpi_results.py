@@ -0,0 +1,253 @@
+"""
+CPI Result Objects
+Array-backed engine results, with a dict-compatible view for existing callers
+"""
+
+import pandas as pd
+import numpy as np
+from collections.abc import Mapping
+from typing import List, Dict, Tuple
+
+
+# Measures derived from the index level, in record and frame column order
+PERIOD_MEASURES = ['YoY_Change_%', 'Annualized_3M_%', 'Annualized_6M_%', 'Rolling_12M_Avg']
+
+
+def _frozen(values, dtype=float) -> np.ndarray:
+    """Contiguous read-only array, so results can be shared without copying"""
+    array = np.ascontiguousarray(values, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+def _to_arrow(columns: Dict[str, np.ndarray]):
+    """Arrow table from named columns (numeric columns are not copied)"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise Exception("Arrow export requires pyarrow (pip install pyarrow)")
+    return pa.table({name: pa.array(values) for name, values in columns.items()})
+
+
+class CPIResult(Mapping):
+    """
+    One index series: months with data plus index, MoM and period measures
+    
+    Values are held in contiguous read-only NumPy arrays. The Mapping
+    interface keeps the old result dict working: result['Monthly_Data']
+    builds the list of month records on demand, and extra keys set by
+    callers (e.g. 'excluded_weight') are stored alongside.
+    """
+    
+    __slots__ = ('variant', 'months', 'index', 'mom', 'measures',
+                 'items_count', 'total_weight', 'extra')
+    
+    def __init__(self, variant: str, months, index, mom, measures,
+                 items_count: int, total_weight: float, extra: Dict = None):
+        """
+        Args:
+            variant: Variant name
+            months: Month labels, one per value
+            index, mom: Index level and MoM change per month
+            measures: (len(PERIOD_MEASURES), months) array, NaN where undefined
+            items_count: Number of items in the basket
+            total_weight: Sum of basket weights
+            extra: Additional dict keys
+        """
+        self.variant = variant
+        self.months = _frozen(months, dtype=object)
+        self.index = _frozen(index)
+        self.mom = _frozen(mom)
+        self.measures = _frozen(measures).reshape(len(PERIOD_MEASURES), len(self.months))
+        self.items_count = int(items_count)
+        self.total_weight = float(total_weight)
+        self.extra = dict(extra or {})
+    
+    # =========================================================================
+    # DICT VIEW
+    # =========================================================================
+    
+    _FIELDS = ('Variant', 'Items_Count', 'Total_Weight', 'Weight_Normalized', 'Monthly_Data')
+    
+    def __getitem__(self, key):
+        if key == 'Variant':
+            return self.variant
+        if key == 'Items_Count':
+            return self.items_count
+        if key == 'Total_Weight':
+            return self.total_weight
+        if key == 'Weight_Normalized':
+            return 100.0 if self.total_weight else float('nan')
+        if key == 'Monthly_Data':
+            return self.monthly_data
+        return self.extra[key]
+    
+    def __setitem__(self, key, value):
+        if key in self._FIELDS:
+            raise Exception(f"{key} is derived from the result arrays and cannot be set")
+        self.extra[key] = value
+    
+    def __iter__(self):
+        yield from self._FIELDS
+        yield from self.extra
+    
+    def __len__(self) -> int:
+        return len(self._FIELDS) + len(self.extra)
+    
+    def __repr__(self) -> str:
+        return f"CPIResult({self.variant!r}, {len(self.months)} months, items={self.items_count})"
+    
+    @property
+    def monthly_data(self) -> List[Dict]:
+        """Month records in the original list-of-dicts layout"""
+        measures = dict(zip(PERIOD_MEASURES, self.measures.tolist()))
+        return [
+            {
+                'Month': month, 'Index': index, 'MoM_Change_%': mom,
+                **{name: (None if np.isnan(values[pos]) else values[pos]) for name, values in measures.items()}
+            }
+            for pos, (month, index, mom) in enumerate(zip(self.months.tolist(), self.index.tolist(), self.mom.tolist()))
+        ]
+    
+    # =========================================================================
+    # ARRAY ACCESS
+    # =========================================================================
+    
+    def measure(self, name: str) -> np.ndarray:
+        """One period measure (see PERIOD_MEASURES) as an array"""
+        return self.measures[PERIOD_MEASURES.index(name)]
+    
+    def copy(self) -> 'CPIResult':
+        """Copy sharing the (read-only) arrays, with its own extra keys"""
+        return CPIResult(self.variant, self.months, self.index, self.mom, self.measures,
+                         self.items_count, self.total_weight, self.extra)
+    
+    def appended(self, month: str, index: float, mom: float, measures) -> 'CPIResult':
+        """New result with one more month at the end"""
+        return CPIResult(
+            self.variant, np.append(self.months, month), np.append(self.index, index),
+            np.append(self.mom, mom),
+            np.concatenate([self.measures, np.asarray(measures, dtype=float).reshape(-1, 1)], axis=1),
+            self.items_count, self.total_weight, self.extra
+        )
+    
+    def index_on(self, months) -> np.ndarray:
+        """Index values on the given month labels, NaN where this result has none"""
+        positions = pd.Index(self.months).get_indexer(list(months))
+        return np.where(positions >= 0, self.index[positions], np.nan)
+    
+    def aligned(self, other: 'CPIResult') -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Months present in both results, with each result's index on them"""
+        months, own_pos, other_pos = np.intersect1d(
+            self.months.astype(str), other.months.astype(str), assume_unique=True, return_indices=True
+        )
+        order = np.argsort(own_pos)
+        return months[order], self.index[own_pos[order]], other.index[other_pos[order]]
+    
+    def to_frame(self) -> pd.DataFrame:
+        """Month, Index, MoM_Change_% and period measures as a DataFrame"""
+        return pd.DataFrame(self._columns(), copy=False)
+    
+    def to_arrow(self):
+        """Same columns as to_frame as a pyarrow Table (needs pyarrow)"""
+        return _to_arrow(self._columns())
+    
+    def _columns(self) -> Dict[str, np.ndarray]:
+        return {
+            'Month': self.months, 'Index': self.index, 'MoM_Change_%': self.mom,
+            **dict(zip(PERIOD_MEASURES, self.measures))
+        }
+
+
+class CPIBatchResult:
+    """
+    Many variants over one month axis, held as (variants, months) arrays
+    
+    Months without data for a variant are NaN. A few thousand variants over
+    a couple of years of months take a few MB, and comparing variants is
+    plain array arithmetic.
+    """
+    
+    __slots__ = ('variants', 'months', 'index', 'mom', 'measures',
+                 'items_count', 'total_weight', 'excluded_weight')
+    
+    def __init__(self, variants: List[str], months: List[str], index, mom, measures,
+                 items_count, total_weight, excluded_weight):
+        """
+        Args:
+            variants: Variant names, one per row
+            months: Month labels, one per column
+            index, mom: (variants, months) arrays
+            measures: (len(PERIOD_MEASURES), variants, months) array
+            items_count, total_weight, excluded_weight: Per-variant arrays
+        """
+        self.variants = list(variants)
+        self.months = _frozen(months, dtype=object)
+        self.index = _frozen(index).reshape(len(self.variants), len(self.months))
+        self.mom = _frozen(mom).reshape(self.index.shape)
+        self.measures = _frozen(measures).reshape((len(PERIOD_MEASURES),) + self.index.shape)
+        self.items_count = _frozen(items_count, dtype=int)
+        self.total_weight = _frozen(total_weight)
+        self.excluded_weight = _frozen(excluded_weight)
+    
+    def __len__(self) -> int:
+        return len(self.variants)
+    
+    def __repr__(self) -> str:
+        return f"CPIBatchResult({len(self.variants)} variants, {len(self.months)} months)"
+    
+    def __getitem__(self, variant: str) -> CPIResult:
+        """Single-variant result (months without data dropped)"""
+        row = self.variants.index(variant)
+        has_data = ~np.isnan(self.index[row])
+        return CPIResult(
+            variant, self.months[has_data], self.index[row, has_data], self.mom[row, has_data],
+            self.measures[:, row, has_data], self.items_count[row], self.total_weight[row],
+            {'excluded_weight': float(self.excluded_weight[row])}
+        )
+    
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the value arrays"""
+        return sum(array.nbytes for array in (
+            self.index, self.mom, self.measures, self.items_count, self.total_weight, self.excluded_weight
+        ))
+    
+    def measure(self, name: str) -> np.ndarray:
+        """One period measure as a (variants, months) array"""
+        return self.measures[PERIOD_MEASURES.index(name)]
+    
+    def difference(self, baseline: str) -> np.ndarray:
+        """Index of every variant minus the baseline variant's, per month"""
+        return self.index - self.index[self.variants.index(baseline)]
+    
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Tidy frame with columns Variant, Month, Index, MoM_Change_%, the
+        PERIOD_MEASURES, Items_Count and Excluded_Weight (months without
+        data dropped)
+        """
+        n_months = len(self.months)
+        frame = pd.DataFrame(self._columns(), copy=False)
+        frame.insert(len(frame.columns), 'Items_Count', np.repeat(self.items_count, n_months))
+        frame.insert(len(frame.columns), 'Excluded_Weight', np.repeat(self.excluded_weight, n_months))
+        return frame.dropna(subset=['Index']).reset_index(drop=True)
+    
+    def to_arrow(self):
+        """Wide-to-long columns of to_frame as a pyarrow Table, NaN months kept"""
+        n_months = len(self.months)
+        return _to_arrow({
+            **self._columns(),
+            'Items_Count': np.repeat(self.items_count, n_months),
+            'Excluded_Weight': np.repeat(self.excluded_weight, n_months),
+        })
+    
+    def _columns(self) -> Dict[str, np.ndarray]:
+        n_months = len(self.months)
+        return {
+            'Variant': np.repeat(np.asarray(self.variants, dtype=object), n_months),
+            'Month': np.tile(self.months, len(self.variants)),
+            'Index': self.index.ravel(),
+            'MoM_Change_%': self.mom.ravel(),
+            **{name: values.ravel() for name, values in zip(PERIOD_MEASURES, self.measures)},
+        }
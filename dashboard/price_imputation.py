@@ -0,0 +1,157 @@
+"""
+Price Imputation
+Fills missing price relatives before aggregation, so the basket stays fixed
+from month to month instead of shrinking to the items priced that month
+"""
+
+import pandas as pd
+import numpy as np
+from typing import List, Tuple
+
+from cpi_catalogue import CPICatalogue
+
+
+# Imputation methods, in the order of their codes in the imputed array (0 = not imputed)
+IMPUTATION_METHODS = ['donor', 'parent', 'carry_forward']
+
+
+def _carry_forward(values: np.ndarray, available: np.ndarray) -> np.ndarray:
+    """Fill each missing month with the item's last priced month (in place); returns filled cells"""
+    months = values.shape[-1]
+    positions = np.where(available, np.arange(months), -1)
+    last_seen = np.maximum.accumulate(positions, axis=-1)
+    filled = ~available & (last_seen >= 0)
+    values[filled] = np.take_along_axis(values, np.maximum(last_seen, 0), axis=-1)[filled]
+    available[filled] = True
+    return filled
+
+
+def _parent_movement(values: np.ndarray, available: np.ndarray, catalogue: CPICatalogue) -> np.ndarray:
+    """
+    Move each missing price with its nearest parent node (in place); returns filled cells
+    
+    The imputed relative is the item's previous month (observed or already
+    imputed) times the weighted change of the items priced in both months
+    within the same subclass, or else the class, group, division or all
+    items, the first with any such items. Month-to-month chaining makes
+    this a loop over months; every item and panel is handled at once.
+    """
+    observed = available.copy()
+    filled = np.zeros(available.shape, dtype=bool)
+    weights = catalogue.item_weights
+    
+    for month in range(1, values.shape[-1]):
+        # Weighted sums over items priced (not imputed) in both months: nodes x panels
+        both = observed[..., month] & observed[..., month - 1]
+        current = np.where(both, values[..., month], 0.0)
+        previous = np.where(both, values[..., month - 1], 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            node_change = (catalogue.node_incidence @ current) / (catalogue.node_incidence @ previous)
+            change = np.broadcast_to((weights @ current) / (weights @ previous), both.shape).copy()
+        
+        # Deepest level with a defined change wins, so fill from the top down
+        for node_ids in catalogue.item_node_ids:
+            level_change = np.where((node_ids >= 0)[:, np.newaxis], node_change[np.maximum(node_ids, 0)], np.nan)
+            change = np.where(np.isfinite(level_change), level_change, change)
+        
+        need = ~available[..., month] & available[..., month - 1] & np.isfinite(change)
+        values[..., month][need] = values[..., month - 1][need] * change[need]
+        available[..., month][need] = True
+        filled[..., month] = need
+    
+    return filled
+
+
+def _donor(values: np.ndarray, available: np.ndarray, states: int) -> np.ndarray:
+    """Fill from the mean of the same item and month in other states (in place); returns filled cells"""
+    # Panels are state-major, so split the panel axis back into (states, rest)
+    shape = values.shape
+    by_state = values.reshape(shape[0], states, -1, shape[-1])
+    priced = available.reshape(by_state.shape)
+    
+    donors = priced.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(priced, by_state, 0.0).sum(axis=1, keepdims=True) / donors
+    filled = ~priced & (donors > 0)
+    by_state[filled] = np.broadcast_to(mean, by_state.shape)[filled]
+    priced[filled] = True
+    return filled.reshape(shape)
+
+
+def impute_prices(values: np.ndarray, available: np.ndarray, catalogue: CPICatalogue,
+                  methods: List[str] = ('parent',)) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Impute missing price relatives with masked array operations
+    
+    Methods run in the order given, each filling only cells still missing:
+    'donor' (mean of the item in other states that month; needs a state
+    axis), 'parent' (previous relative moved with the nearest parent node)
+    and 'carry_forward' (last priced month). Cells before an item's first
+    price stay missing under 'parent' and 'carry_forward'.
+    
+    Args:
+        values: Price relatives shaped (items, months) or
+            (states, sectors, items, months), items in catalogue order
+        available: Same shape, True where a price exists
+        catalogue: Catalogue of the items (for weights and parent nodes)
+        methods: Methods to apply, from IMPUTATION_METHODS
+    
+    Returns:
+        Tuple of (values, available, imputed), shaped like values; imputed
+        holds 1 + the IMPUTATION_METHODS position of the method that filled
+        each cell, 0 for cells not imputed
+    """
+    for method in methods:
+        if method not in IMPUTATION_METHODS:
+            raise Exception(f"Unknown imputation method: {method} (use one of {IMPUTATION_METHODS})")
+    
+    shape = np.shape(values)
+    if len(shape) not in (2, 4) or np.shape(available) != shape:
+        raise Exception(f"Expected (items, months) or (states, sectors, items, months) arrays, got {shape}")
+    if shape[-2] != catalogue.n_items:
+        raise Exception(f"Expected {catalogue.n_items} items, got {shape[-2]}")
+    if 'donor' in methods and len(shape) != 4:
+        raise Exception("Donor imputation needs a (states, sectors, items, months) panel")
+    
+    # Work on (items, panels, months) so node sums are one sparse product per month
+    panels = int(np.prod(shape[:-2]))
+    work_values = np.moveaxis(np.asarray(values, dtype=float), -2, 0).reshape(shape[-2], panels, shape[-1]).copy()
+    work_available = np.moveaxis(np.asarray(available, dtype=bool), -2, 0).reshape(work_values.shape).copy()
+    imputed = np.zeros(work_values.shape, dtype=np.int8)
+    
+    for method in methods:
+        if method == 'donor':
+            filled = _donor(work_values, work_available, shape[0])
+        elif method == 'parent':
+            filled = _parent_movement(work_values, work_available, catalogue)
+        else:
+            filled = _carry_forward(work_values, work_available)
+        imputed[filled] = IMPUTATION_METHODS.index(method) + 1
+    
+    def restore(array):
+        return np.moveaxis(array.reshape((shape[-2],) + shape[:-2] + shape[-1:]), 0, -2)
+    
+    return restore(np.where(work_available, work_values, 0.0)), restore(work_available), restore(imputed)
+
+
+def imputation_counts(imputed: np.ndarray, available: np.ndarray, months: List[str]) -> pd.DataFrame:
+    """
+    Imputed cells per month and method, plus cells still missing
+    
+    Returns:
+        DataFrame with columns Month, Method and Cells ('missing' for
+        cells left without a price)
+    """
+    months_axis = imputed.reshape(-1, imputed.shape[-1])
+    missing = ~available.reshape(months_axis.shape)
+    counts = {
+        method: (months_axis == code + 1).sum(axis=0)
+        for code, method in enumerate(IMPUTATION_METHODS)
+    }
+    counts['missing'] = missing.sum(axis=0)
+    
+    return pd.DataFrame({
+        'Month': np.tile(np.asarray(months, dtype=object), len(counts)),
+        'Method': np.repeat(list(counts.keys()), len(months)),
+        'Cells': np.concatenate(list(counts.values())),
+    })
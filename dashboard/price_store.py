@@ -0,0 +1,382 @@
+"""
+Price Storage
+Columnar sidecar cache for price workbooks, so repeat loads skip openpyxl,
+and a memory-mapped tensor store for multi-state price panels
+"""
+
+import hashlib
+import json
+import os
+import re
+from datetime import date
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from typing import Callable, List, Dict, Tuple
+
+
+# Bumped whenever the sidecar layout changes, invalidating older caches
+CACHE_FORMAT = 1
+
+# Month columns: 'YYYY-MM', optionally prefixed (e.g. 'Price_Relative_2024-01')
+MONTH_PATTERN = re.compile(r'(?:^|_)(\d{4})-(\d{2})$')
+
+
+def month_label(col) -> str:
+    """
+    Column label as text, with date headers (as Excel often stores month
+    columns) written as 'YYYY-MM'
+    """
+    if isinstance(col, (date, np.datetime64)) and not pd.isna(col):
+        return pd.Timestamp(col).strftime('%Y-%m')
+    return str(col).strip()
+
+
+def detect_month_columns(columns) -> List[str]:
+    """
+    Month columns of a price sheet in calendar order
+    
+    Args:
+        columns: Column labels of the sheet
+    
+    Returns:
+        Labels matching YYYY-MM (with an optional prefix) or holding a
+        date, oldest first
+    """
+    months = []
+    for col in columns:
+        match = MONTH_PATTERN.search(month_label(col))
+        if match and 1 <= int(match.group(2)) <= 12:
+            months.append((int(match.group(1)), int(match.group(2)), col))
+    return [col for _, _, col in sorted(months)]
+
+
+def normalize_month_columns(table: pd.DataFrame, months: List = None) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Rename date month headers to their 'YYYY-MM' label
+    
+    Args:
+        table: Table with month columns
+        months: Month columns in calendar order (default: detected)
+    
+    Returns:
+        Tuple of (table, month columns in calendar order), with every month
+        label a string; the table is only copied when a header changes
+    """
+    months = list(months) if months is not None else detect_month_columns(table.columns)
+    renamed = {col: month_label(col) for col in months if not isinstance(col, str)}
+    if renamed:
+        table = table.rename(columns=renamed)
+    return table, [renamed.get(col, col) for col in months]
+
+
+def cache_paths(source: Path, tag: str = None) -> Tuple[Path, Path]:
+    """
+    Sidecar files (values .npy, metadata .json) next to a workbook
+    
+    A tag (e.g. a sheet's role) keeps caches of different tables read
+    from the same workbook apart.
+    """
+    source = Path(source)
+    stem = source.name + (f'.{tag}' if tag else '')
+    return (
+        source.with_name(stem + '.cache.npy'),
+        source.with_name(stem + '.cache.json'),
+    )
+
+
+def _file_hash(path: Path) -> str:
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_matches(source: Path, meta: dict) -> bool:
+    """
+    Check a cache's recorded fingerprint against the source file
+    
+    Size must match. A matching mtime is trusted as is; otherwise (file
+    copied or touched) the content hash decides.
+    """
+    stat = source.stat()
+    recorded = meta.get('source', {})
+    if meta.get('format') != CACHE_FORMAT or recorded.get('size') != stat.st_size:
+        return False
+    if recorded.get('mtime_ns') == stat.st_mtime_ns:
+        return True
+    return recorded.get('sha256') == _file_hash(source)
+
+
+def _read_cache(source: Path, tag: str = None):
+    """Table from a valid sidecar cache, or None"""
+    values_path, meta_path = cache_paths(source, tag)
+    if not (values_path.exists() and meta_path.exists()):
+        return None
+    
+    try:
+        with open(meta_path) as handle:
+            meta = json.load(handle)
+        if not _source_matches(source, meta):
+            return None
+        
+        values = np.load(values_path)
+        months = meta['months']
+        columns = dict(meta['labels'])
+        columns.update(zip(months, values.T))
+        prices_df = pd.DataFrame({col: columns[col] for col in meta['columns']})
+        return prices_df, months
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_cache(source: Path, prices_df: pd.DataFrame, months: List[str], tag: str = None):
+    """Write the sidecar cache; a read-only location simply goes uncached"""
+    values_path, meta_path = cache_paths(source, tag)
+    stat = source.stat()
+    label_columns = [col for col in prices_df.columns if col not in months]
+    meta = {
+        'format': CACHE_FORMAT,
+        'source': {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': _file_hash(source),
+        },
+        'columns': [str(col) for col in prices_df.columns],
+        'months': [str(col) for col in months],
+        'labels': {
+            str(col): [None if pd.isna(value) else value for value in prices_df[col].tolist()]
+            for col in label_columns
+        },
+    }
+    
+    # Write to temporary names first so a crash never leaves a half-written cache
+    try:
+        tmp_values = values_path.with_name(values_path.name + '.tmp.npy')
+        tmp_meta = meta_path.with_name(meta_path.name + '.tmp')
+        np.save(tmp_values, prices_df[months].to_numpy(dtype=float))
+        with open(tmp_meta, 'w') as handle:
+            json.dump(meta, handle, default=str)
+        os.replace(tmp_values, values_path)
+        os.replace(tmp_meta, meta_path)
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def read_cached_table(source: Path, parse: Callable[[Path], pd.DataFrame], tag: str = None,
+                      use_cache: bool = True) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Read a table with YYYY-MM columns, using the sidecar cache when it is current
+    
+    The first read calls parse and writes the cache; later reads load the
+    month values from a .npy file and the label columns from JSON. Any
+    stale, missing or unreadable cache falls back to parse.
+    
+    Args:
+        source: Source file the table is read from
+        parse: Builds the table from the source file
+        tag: Cache name suffix for tables other than the main price sheet
+        use_cache: Set False to always parse the source file
+    
+    Returns:
+        Tuple of (DataFrame, month columns in calendar order)
+    """
+    source = Path(source)
+    if use_cache:
+        cached = _read_cache(source, tag)
+        if cached is not None:
+            return cached
+    
+    # Date headers become 'YYYY-MM', so parsed and cached reads label months alike
+    table, months = normalize_month_columns(parse(source))
+    
+    if use_cache:
+        _write_cache(source, table, months, tag)
+    return table, months
+
+
+def _parse_price_sheet(source: Path) -> pd.DataFrame:
+    if source.suffix.lower() == '.csv':
+        return pd.read_csv(source)
+    return pd.read_excel(source)
+
+
+def read_price_table(source: Path, use_cache: bool = True) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Read a price workbook, using the sidecar cache when it is current
+    
+    Args:
+        source: Price workbook (.xlsx) or CSV
+        use_cache: Set False to always parse the source file
+    
+    Returns:
+        Tuple of (prices DataFrame, month columns in calendar order)
+    """
+    return read_cached_table(source, _parse_price_sheet, use_cache=use_cache)
+
+
+# =============================================================================
+# MEMORY-MAPPED PRICE TENSOR
+# =============================================================================
+
+class PriceTensorStore:
+    """
+    On-disk state x sector x item x month price panel, opened memory-mapped
+    
+    A store is a directory with values.npy (float32 or float64, 0 where no
+    price), available.npy (bool) and axes.json (labels per axis). Arrays are
+    opened read-only with mmap_mode='r', so every engine and process reading
+    the same store shares pages through the OS page cache, and panel()
+    returns views into the mapping rather than copies.
+    """
+    
+    DIMS = ('state', 'sector', 'item', 'month')
+    
+    def __init__(self, path: Path):
+        """Open an existing store directory"""
+        self.path = Path(path)
+        with open(self.path / 'axes.json') as handle:
+            meta = json.load(handle)
+        
+        self.labels = {dim: meta['labels'][dim] for dim in self.DIMS}
+        self.values = np.load(self.path / 'values.npy', mmap_mode='r')
+        self.available = np.load(self.path / 'available.npy', mmap_mode='r')
+        self._positions = {
+            dim: {label: pos for pos, label in enumerate(labels)}
+            for dim, labels in self.labels.items()
+        }
+    
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.values.shape
+    
+    @classmethod
+    def write(cls, path: Path, prices: np.ndarray, labels: Dict[str, List],
+              dtype=np.float32) -> 'PriceTensorStore':
+        """
+        Write a dense price tensor (NaN = no price) and open it
+        
+        Args:
+            path: Store directory (created if needed)
+            prices: Array shaped (states, sectors, items, months)
+            labels: Axis labels keyed by 'state', 'sector', 'item', 'month'
+            dtype: On-disk float type
+        """
+        prices = np.asarray(prices)
+        available = np.isfinite(prices)
+        values, available_out = cls._allocate(path, prices.shape, labels, dtype)
+        values[...] = np.where(available, prices, 0)
+        available_out[...] = available
+        values.flush()
+        available_out.flush()
+        return cls(path)
+    
+    @classmethod
+    def from_long_frame(cls, path: Path, frame: pd.DataFrame, columns: Dict[str, str],
+                        value_column: str, item_labels: List = None,
+                        dtype=np.float32) -> 'PriceTensorStore':
+        """
+        Build a store from long-format rows (one price per row)
+        
+        The tensor is filled directly in the memory-mapped files, so the full
+        panel never has to fit in memory as a DataFrame pivot.
+        
+        Args:
+            path: Store directory (created if needed)
+            frame: Long-format price rows
+            columns: Frame column for each axis ('state', 'sector', 'item', 'month')
+            value_column: Frame column holding the price relative
+            item_labels: Item axis order; pass the engine's item codes so
+                panels line up with its weights without reindexing
+            dtype: On-disk float type
+        """
+        labels, positions = {}, []
+        for dim in cls.DIMS:
+            keys = frame[columns[dim]].astype(str).str.strip()
+            if dim == 'item' and item_labels is not None:
+                labels[dim] = [str(label) for label in item_labels]
+            elif dim == 'month':
+                labels[dim] = detect_month_columns(keys.unique()) or sorted(keys.unique())
+            else:
+                labels[dim] = sorted(keys.unique())
+            lookup = {label: pos for pos, label in enumerate(labels[dim])}
+            positions.append(keys.map(lookup).to_numpy(dtype=float))
+        
+        prices = frame[value_column].to_numpy(dtype=float)
+        keep = np.isfinite(prices) & np.all([np.isfinite(pos) for pos in positions], axis=0)
+        index = tuple(pos[keep].astype(int) for pos in positions)
+        
+        shape = tuple(len(labels[dim]) for dim in cls.DIMS)
+        values, available = cls._allocate(path, shape, labels, dtype)
+        values[index] = prices[keep]
+        available[index] = True
+        values.flush()
+        available.flush()
+        return cls(path)
+    
+    @classmethod
+    def _allocate(cls, path: Path, shape: Tuple[int, ...], labels: Dict[str, List], dtype):
+        """Create zeroed value and availability files plus the axis index"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for dim, size in zip(cls.DIMS, shape):
+            if len(labels[dim]) != size:
+                raise Exception(f"{dim} axis has {size} entries but {len(labels[dim])} labels")
+        
+        with open(path / 'axes.json', 'w') as handle:
+            json.dump({
+                'dims': list(cls.DIMS),
+                'labels': {dim: [str(label) for label in labels[dim]] for dim in cls.DIMS},
+            }, handle)
+        
+        values = np.lib.format.open_memmap(path / 'values.npy', mode='w+', dtype=dtype, shape=shape)
+        available = np.lib.format.open_memmap(path / 'available.npy', mode='w+', dtype=bool, shape=shape)
+        return values, available
+    
+    def panel(self, state: str, sector: str, item_codes: List = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Items x months values and availability for one state and sector
+        
+        Args:
+            state: State label
+            sector: Sector label (e.g. 'Rural', 'Urban', 'Combined')
+            item_codes: Item order wanted by the caller. When it matches the
+                store's item axis (or is None) the result is a zero-copy view
+                of the mapping; otherwise rows are gathered into a copy, with
+                unknown items left unpriced.
+        
+        Returns:
+            Tuple of (values, available), both shaped (items, months)
+        """
+        if state not in self._positions['state']:
+            raise Exception(f"Unknown state: {state}")
+        if sector not in self._positions['sector']:
+            raise Exception(f"Unknown sector: {sector}")
+        
+        s = self._positions['state'][state]
+        r = self._positions['sector'][sector]
+        return self._align_items(self.values[s, r], self.available[s, r], item_codes)
+    
+    def aligned(self, item_codes: List = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Full state x sector x item x month tensors in the caller's item order
+        
+        Same view-or-gather behaviour as panel(), over every state and sector.
+        """
+        return self._align_items(self.values, self.available, item_codes)
+    
+    def _align_items(self, values: np.ndarray, available: np.ndarray,
+                     item_codes: List = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Reorder the item axis (second to last) to item_codes, copying only if needed"""
+        if item_codes is None or list(map(str, item_codes)) == self.labels['item']:
+            return values, available
+        
+        rows = np.array([self._positions['item'].get(str(code), -1) for code in item_codes])
+        found = rows >= 0
+        gathered_values = np.take(values, np.maximum(rows, 0), axis=-2)
+        gathered_available = np.take(available, np.maximum(rows, 0), axis=-2)
+        gathered_values[..., ~found, :] = 0
+        gathered_available[..., ~found, :] = False
+        return gathered_values, gathered_available
@@ -3,15 +3,24 @@ Test script for CPI Engine
 Validates that the engine works with weights_new data
 """
 
+import shutil
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
+import numpy as np
+import pytest
 
 # Add dashboard to path
 dashboard_dir = Path(__file__).parent / 'dashboard'
 sys.path.insert(0, str(dashboard_dir))
 
+import cpi_engine
 from cpi_engine import CPIEngine
+from cpi_catalogue import CPICatalogue
+from back_series import BackSeriesLinker, published_series
+from price_store import PriceTensorStore, cache_paths, detect_month_columns, read_price_table
 
 def test_engine():
     """Test CPI Engine initialization and basic calculations"""
@@ -74,6 +83,744 @@ def test_engine():
     
     return engine
 
+def _engine_with_prices():
+    """Engine loaded with weights_new and the sample price_data.xlsx"""
+    root = Path(__file__).parent
+    engine = CPIEngine(root / 'weights_new')
+    engine.load_prices(root / 'price_data.xlsx', use_cache=False)
+    return engine
+
+def test_laspeyres_matrix_matches_loop():
+    """Matrix kernel reproduces the per-month weighted average"""
+    engine = _engine_with_prices()
+    items = engine.items_df['Item_Code'].tolist()[:40]
+    result = engine._calculate_laspeyres(items, "Sample")
+    
+    weights = engine.items_df.set_index('Item_Code')['Weight'][items]
+    prices = engine.prices_df.set_index('Item_Code').loc[items]
+    for record in result['Monthly_Data']:
+        expected = (prices[record['Month']] * weights).sum() / weights.sum() * 100
+        assert abs(record['Index'] - expected) < 1e-8
+    
+    assert result['Items_Count'] == 40
+    assert result['Monthly_Data'][0]['MoM_Change_%'] == 0.0
+
+def test_scenarios_match_single_calls():
+    """Batch scenario evaluation agrees with get_index_with_exclusions"""
+    engine = _engine_with_prices()
+    scenarios = {
+        'Ex Food': {'excluded_divisions': ['1.0']},
+        'Ex Food & Fuel': {'excluded_divisions': ['1.0'], 'excluded_groups': ['4.5']},
+        'Headline': {},
+    }
+    batch = engine.get_indices_for_scenarios(scenarios)
+    
+    for name, exclusions in scenarios.items():
+        single = engine.get_index_with_exclusions(**exclusions)
+        rows = batch[batch['Variant'] == name]
+        assert len(rows) == len(single['Monthly_Data'])
+        for (_, row), record in zip(rows.iterrows(), single['Monthly_Data']):
+            assert abs(row['Index'] - record['Index']) < 1e-8
+        assert rows['Items_Count'].iloc[0] == single['Items_Count']
+
+def test_nested_exclusions_count_items_once():
+    """Nested selections subtract each item's partial sums only once"""
+    engine = _engine_with_prices()
+    division_only = engine.get_index_with_exclusions(excluded_divisions=['1.0'])
+    nested = engine.get_index_with_exclusions(
+        excluded_divisions=['1.0'], excluded_groups=['1.1'], excluded_classes=['01.1.1']
+    )
+    
+    assert nested['excluded_items_count'] == division_only['excluded_items_count']
+    assert abs(nested['excluded_weight'] - engine.hierarchy['1.0']['weight']) < 1e-6
+    for a, b in zip(nested['Monthly_Data'], division_only['Monthly_Data']):
+        assert abs(a['Index'] - b['Index']) < 1e-8
+    
+    remaining = set(engine.items_df['Item_Code']) - set(
+        item for g in engine.hierarchy['1.0']['groups'].values()
+        for c in g['classes'].values() for item in c['items']
+    )
+    direct = engine._calculate_laspeyres(list(remaining), "Direct")
+    assert abs(direct['Monthly_Data'][-1]['Index'] - nested['Monthly_Data'][-1]['Index']) < 1e-8
+
+def test_item_paths_match_hierarchy():
+    """Flat item paths and parent codes agree with the nested hierarchy"""
+    engine = CPIEngine(Path(__file__).parent / 'weights_new')
+    paths = engine.item_paths.set_index('Item_Code')
+    
+    for div_code, div_data in engine.hierarchy.items():
+        for grp_code, grp_data in div_data['groups'].items():
+            assert engine.parent_codes['group'][grp_code] == div_code
+            for cls_code, cls_data in grp_data['classes'].items():
+                assert engine.parent_codes['class'][cls_code] == grp_code
+                assert (paths.loc[cls_data['items'], 'class'] == cls_code).all()
+                assert (paths.loc[cls_data['items'], 'division'] == div_code).all()
+
+def test_catalogue_masks():
+    """Node bitsets OR together into the same items as the hierarchy lists"""
+    catalogue = CPICatalogue.from_directory(Path(__file__).parent / 'weights_new')
+    
+    food = catalogue.nodes_for_codes(divisions=['1.0'])
+    food_and_fuel = catalogue.nodes_for_codes(divisions=['1.0'], groups=['4.5'], classes=['01.1.1'])
+    
+    mask = catalogue.nodes_mask(food_and_fuel)
+    expected = (catalogue.item_paths['division'] == '1.0') | (catalogue.item_paths['group'] == '4.5')
+    assert (mask == expected.to_numpy()).all()
+    
+    by_name = catalogue.mask_for_names({'division': ['Food and beverages'], 'item': ['Rice']})
+    assert (by_name == catalogue.nodes_mask(food)).all()
+    assert catalogue.mask_key(mask) != catalogue.mask_key(by_name)
+
+def test_result_cache_counters_and_invalidation():
+    """Repeat selections hit the LRU cache; load_prices invalidates it"""
+    root = Path(__file__).parent
+    engine = CPIEngine(root / 'weights_new', cache_size=2)
+    engine.load_prices(root / 'price_data.xlsx', use_cache=False)
+    
+    first = engine.get_index_with_exclusions(excluded_divisions=['1.0'])
+    first['Monthly_Data'][0]['Index'] = -1.0
+    # Same items, different spelling of the selection
+    again = engine.get_index_with_exclusions(excluded_divisions=['1.0'], excluded_groups=['1.1'])
+    assert again['Monthly_Data'][0]['Index'] > 0
+    assert engine.cache_info()['hits'] == 1
+    
+    engine.get_headline_index()
+    engine.get_index_with_exclusions(excluded_groups=['4.5'])
+    info = engine.cache_info()
+    assert info['misses'] == 3 and info['evictions'] == 1 and info['size'] == 2
+    
+    engine.load_prices(root / 'price_data.xlsx', use_cache=False)
+    assert engine.cache_info()['size'] == 0
+    engine.get_headline_index()
+    assert engine.cache_info()['misses'] == 4
+
+def test_append_month_matches_full_load():
+    """Appending the last month reproduces the fully loaded results"""
+    full = _engine_with_prices()
+    engine = _engine_with_prices()
+    last = engine.months[-1]
+    relatives = engine.prices_df.set_index('Item_Code')[last]
+    
+    # Rebuild the engine without the last month, then warm the cache
+    engine.load_price_frame(engine.prices_df.drop(columns=[last]))
+    engine.get_headline_index()
+    engine.get_index_with_exclusions(excluded_divisions=['1.0'])
+    
+    summary = engine.append_month(last, relatives.to_dict())
+    expected = full.get_headline_index()['Monthly_Data']
+    assert summary['Month'] == last
+    assert abs(summary['Index'] - expected[-1]['Index']) < 1e-9
+    assert abs(summary['MoM_Change_%'] - expected[-1]['MoM_Change_%']) < 1e-9
+    
+    for extended, reference in [
+        (engine.get_headline_index(), full.get_headline_index()),
+        (engine.get_index_with_exclusions(excluded_divisions=['1.0']),
+         full.get_index_with_exclusions(excluded_divisions=['1.0'])),
+        (engine.get_index_with_exclusions(excluded_groups=['4.5']),
+         full.get_index_with_exclusions(excluded_groups=['4.5'])),
+    ]:
+        assert len(extended['Monthly_Data']) == len(reference['Monthly_Data'])
+        for got, want in zip(extended['Monthly_Data'], reference['Monthly_Data']):
+            assert got['Month'] == want['Month']
+            assert abs(got['Index'] - want['Index']) < 1e-9
+            assert abs(got['MoM_Change_%'] - want['MoM_Change_%']) < 1e-9
+        assert abs(extended['Monthly_Data'][-1]['YoY_Change_%'] - reference['Monthly_Data'][-1]['YoY_Change_%']) < 1e-9
+    assert engine.cache_info()['hits'] == 2
+    pd.testing.assert_series_equal(engine.prices_df[last], full.prices_df[last])
+    
+    with pytest.raises(Exception, match="No priced items"):
+        engine.append_month('2099-01', {})
+    
+    # Months are ordered by calendar month, whatever the label's prefix or type
+    prefixed = full.prices_df.rename(columns={month: f'Price_Relative_{month}' for month in full.months})
+    engine.load_price_frame(prefixed.drop(columns=[f'Price_Relative_{last}']))
+    with pytest.raises(Exception, match="must be later"):
+        engine.append_month(engine.months[-1][-7:], relatives.to_dict())
+    assert engine.append_month(last, relatives.to_dict())['Month'] == last
+    
+    dated = full.prices_df.rename(columns={month: pd.Timestamp(month + '-01') for month in full.months})
+    engine.load_price_frame(dated.drop(columns=[pd.Timestamp(last + '-01')]))
+    assert engine.append_month(pd.Timestamp(last + '-01'), relatives.to_dict())['Month'] == last
+    assert engine.months == full.months
+
+def test_price_cache_round_trip(tmp_path):
+    """Sidecar cache reproduces the workbook and is rebuilt when it changes"""
+    source = tmp_path / 'price_data.xlsx'
+    source.write_bytes((Path(__file__).parent / 'price_data.xlsx').read_bytes())
+    reference = pd.read_excel(source)
+    
+    first, months = read_price_table(source)
+    assert all(path.exists() for path in cache_paths(source))
+    cached, cached_months = read_price_table(source)
+    pd.testing.assert_frame_equal(cached, reference)
+    assert cached_months == months == detect_month_columns(reference.columns)
+    
+    # A different file at the same path must not be served from the old cache
+    reference.iloc[:10].to_excel(source, index=False)
+    assert len(read_price_table(source)[0]) == 10
+    
+    assert detect_month_columns(['Item_Code', 'Price_Relative_2025-01', '2024-12', '2024-13', 'Note-2024']) == [
+        '2024-12', 'Price_Relative_2025-01'
+    ]
+    assert detect_month_columns(['Item_Code', '2024-03', pd.Timestamp('2024-01-01')]) == [
+        pd.Timestamp('2024-01-01'), '2024-03'
+    ]
+    
+    # Excel date headers are read as 'YYYY-MM', from the workbook and from the cache alike
+    dated = reference.iloc[:10].rename(columns={months[0]: pd.Timestamp(months[0] + '-01')})
+    dated.to_excel(source, index=False)
+    parsed, parsed_months = read_price_table(source)
+    cached, cached_months = read_price_table(source)
+    assert parsed_months == cached_months == months
+    pd.testing.assert_frame_equal(cached, parsed)
+    
+    # A frame with date headers passed straight to the engine is labelled the same way
+    engine = CPIEngine(Path(__file__).parent / 'weights_new')
+    engine.load_price_frame(dated)
+    assert engine.months == engine.snapshot.months == months
+    assert months[0] in engine.prices_df.columns
+
+def test_price_tensor_store_panels(tmp_path):
+    """Engines read state/sector panels from a shared memory-mapped store"""
+    reference = _engine_with_prices()
+    long_prices = reference.prices_df.melt(id_vars=['Item_Code', 'Item_Name'], var_name='Month', value_name='Price')
+    urban = long_prices.assign(Price=long_prices['Price'] * 1.1, Sector='Urban')
+    long_prices = pd.concat([long_prices.assign(Sector='Rural'), urban]).assign(State='All India')
+    
+    columns = {'state': 'State', 'sector': 'Sector', 'item': 'Item_Code', 'month': 'Month'}
+    PriceTensorStore.from_long_frame(tmp_path / 'panel', long_prices, columns, 'Price',
+                                     item_labels=reference.catalogue.item_codes)
+    store = PriceTensorStore(tmp_path / 'panel')
+    assert store.shape == (1, 2, reference.catalogue.n_items, len(reference.months))
+    
+    engine = CPIEngine(Path(__file__).parent / 'weights_new')
+    engine.load_price_tensor(store, 'All India', 'Rural')
+    assert np.shares_memory(engine.snapshot.values, store.values)
+    
+    expected = reference.get_index_with_exclusions(excluded_divisions=['1.0'])['Monthly_Data']
+    result = engine.get_index_with_exclusions(excluded_divisions=['1.0'])['Monthly_Data']
+    assert [r['Month'] for r in result] == [r['Month'] for r in expected]
+    for got, want in zip(result, expected):
+        assert abs(got['Index'] - want['Index']) / want['Index'] < 1e-6
+    
+    engine.load_price_tensor(store, 'All India', 'Urban')
+    urban_index = engine.get_headline_index()['Monthly_Data'][0]['Index']
+    assert abs(urban_index / reference.get_headline_index()['Monthly_Data'][0]['Index'] - 1.1) < 1e-6
+
+def test_panel_indices_match_single_panels(tmp_path):
+    """One broadcast call matches loading each state/sector panel separately"""
+    reference = _engine_with_prices()
+    catalogue = reference.catalogue
+    base = reference.prices_df.set_index('Item_Code').reindex(catalogue.item_codes)[reference.months].to_numpy()
+    rng = np.random.default_rng(0)
+    prices = base * rng.uniform(0.9, 1.1, size=(2, 2) + base.shape)
+    prices[1, 0, :5] = np.nan
+    
+    labels = {'state': ['Bihar', 'Kerala'], 'sector': ['Rural', 'Urban'],
+              'item': list(catalogue.item_codes), 'month': reference.months}
+    store = PriceTensorStore.write(tmp_path / 'panel', prices, labels, dtype=np.float64)
+    
+    scenarios = {'Headline': {}, 'Ex Food': {'excluded_divisions': ['1.0']}}
+    no_food = pd.Series(np.where(catalogue.nodes_mask(catalogue.nodes_for_codes(['1.0'])),
+                                 0.0, catalogue.item_weights), index=catalogue.item_codes)
+    panel = reference.get_panel_indices(store, scenarios, state_weights={'Kerala': no_food})
+    assert len(panel) == 2 * 2 * 2 * len(reference.months)
+    
+    engine = CPIEngine(Path(__file__).parent / 'weights_new')
+    for state in labels['state']:
+        for sector in labels['sector']:
+            engine.load_price_tensor(store, state, sector)
+            rows = panel[(panel['State'] == state) & (panel['Sector'] == sector)]
+            single = engine.get_indices_for_scenarios(scenarios)
+            if state == 'Kerala':
+                # Zero food weights reproduce the ex-food variant
+                single = single[single['Variant'] == 'Ex Food']
+                rows = rows[rows['Variant'] == 'Headline']
+            assert np.allclose(rows['Index'].to_numpy(), single['Index'].to_numpy())
+            assert np.allclose(rows['MoM_Change_%'].to_numpy(), single['MoM_Change_%'].to_numpy())
+
+def test_period_measures_align_on_calendar_months():
+    """YoY, annualized and rolling measures follow dates, not positions"""
+    engine = _engine_with_prices()
+    records = pd.DataFrame(engine.get_headline_index()['Monthly_Data']).set_index('Month')
+    index = records['Index']
+    assert np.allclose(records['YoY_Change_%'].iloc[12:], index.pct_change(12).iloc[12:] * 100)
+    assert np.allclose(records['Annualized_3M_%'].iloc[3:], ((index / index.shift(3)) ** 4 - 1).iloc[3:] * 100)
+    assert np.allclose(records['Rolling_12M_Avg'].iloc[11:], index.rolling(12).mean().iloc[11:])
+    assert records['YoY_Change_%'].iloc[:12].isna().all()
+    
+    # Without June 2024 loaded, measures needing it are missing rather than shifted
+    engine.load_price_frame(engine.prices_df.drop(columns=['2024-06']))
+    gapped = pd.DataFrame(engine.get_headline_index()['Monthly_Data']).set_index('Month')
+    assert gapped['YoY_Change_%'].isna()['2025-06']
+    assert abs(gapped.loc['2025-07', 'YoY_Change_%'] - records.loc['2025-07', 'YoY_Change_%']) < 1e-9
+    assert gapped['Rolling_12M_Avg'].notna().sum() == 7  # windows ending 2025-06 onwards
+    
+    scenarios = engine.get_indices_for_scenarios({'Headline': {}})
+    assert np.allclose(scenarios['YoY_Change_%'], gapped['YoY_Change_%'], equal_nan=True)
+
+def test_array_backed_results():
+    """Results wrap arrays but still read like the old result dicts"""
+    engine = _engine_with_prices()
+    headline = engine.get_headline_index()
+    core = engine.get_index_with_exclusions(excluded_divisions=['1.0'])
+    
+    assert core['Variant'] == 'CPI with Exclusions' and 'excluded_weight' in core
+    assert core['Monthly_Data'][-1]['Index'] == core.index[-1]
+    assert dict(core)['Items_Count'] == core.items_count
+    assert np.shares_memory(core.to_frame()['Index'].to_numpy(), core.index)
+    assert not core.index.flags.writeable
+    
+    comparison = engine.get_comparison(headline, core)
+    assert np.allclose(comparison['Difference'], np.round(core.index - headline.index, 2))
+    
+    scenarios = {f'Ex {code}': {'excluded_divisions': [code]}
+                 for level, code in engine.catalogue.node_keys if level == 'division'}
+    scenarios = {f'{name} #{copy}': spec for copy in range(200) for name, spec in scenarios.items()}
+    batch = engine.get_scenario_batch(scenarios)
+    assert len(batch) == len(scenarios) and batch.nbytes < 5 * 2 ** 20
+    
+    first = batch[next(iter(scenarios))]
+    single = engine.get_index_with_exclusions(**next(iter(scenarios.values())))
+    assert np.allclose(first.index, single.index) and first.items_count == single.items_count
+    assert np.allclose(batch.difference(next(iter(scenarios)))[0], 0.0)
+
+def test_compare_variants_aligns_on_month_labels():
+    """Variants with missing months line up with the baseline by label"""
+    engine = _engine_with_prices()
+    headline = engine.get_headline_index()
+    core = engine.get_index_with_exclusions(excluded_divisions=['1.0'])
+    
+    # Drop a month from one variant; its other months must not shift
+    kept = core.months != '2024-06'
+    gapped = type(core)('Gapped', core.months[kept], core.index[kept], core.mom[kept],
+                        core.measures[:, kept], core.items_count, core.total_weight)
+    
+    long = engine.compare_variants(headline, {'Core': core, 'Gapped': gapped})
+    assert len(long) == 2 * len(headline.months)
+    gapped_rows = long[long['Variant'] == 'Gapped'].set_index('Month')
+    assert np.isnan(gapped_rows.loc['2024-06', 'Index'])
+    assert gapped_rows.loc['2024-07', 'Index'] == core.index[list(core.months).index('2024-07')]
+    
+    wide = engine.compare_variants(headline, {'Core': core, 'Gapped': gapped}, output='wide')
+    assert np.allclose(wide[('Difference', 'Core')], core.index - headline.index)
+    assert list(wide['Index'].columns) == ['Core', 'Gapped']
+    
+    batch = engine.get_scenario_batch({'Core': {'excluded_divisions': ['1.0']}})
+    arrays = engine.compare_variants(headline, batch, output='arrays')
+    assert np.allclose(arrays['Difference_%'][0], (core.index - headline.index) / headline.index * 100)
+    assert len(engine.get_comparison(headline, gapped)) == len(headline.months) - 1
+    
+    # A variant that calculated to nothing is skipped, not an AttributeError
+    with pytest.warns(UserWarning, match="Skipping variants with no result: Empty"):
+        skipped = engine.compare_variants(headline, {'Core': core, 'Empty': None})
+    assert set(skipped['Variant']) == {'Core'}
+    with pytest.raises(Exception, match="No baseline"):
+        engine.compare_variants(None, {'Core': core})
+
+def _naive_trimmed_mean(changes, weights, trim):
+    """Reference trimmed mean from one month's sorted items"""
+    keep = ~np.isnan(changes)
+    changes, weights = changes[keep], weights[keep]
+    order = np.argsort(changes)
+    changes, shares = changes[order], weights[order] / weights.sum()
+    upper = np.cumsum(shares)
+    lower = upper - shares
+    kept = np.clip(np.minimum(upper, 1 - trim) - np.maximum(lower, trim), 0, None)
+    return (kept * changes).sum() / kept.sum(), changes[np.argmax(upper >= 0.5)]
+
+def test_distribution_core_measures(tmp_path):
+    """Vectorized trimmed means and weighted median match a per-month loop"""
+    engine = _engine_with_prices()
+    catalogue = engine.catalogue
+    rng = np.random.default_rng(1)
+    prices = 100 * np.cumprod(rng.lognormal(0, 0.02, size=(3, 2, catalogue.n_items, 14)), axis=-1)
+    prices[0, 1, rng.random((catalogue.n_items, 14)) < 0.1] = np.nan
+    months = [f'2024-{m:02d}' for m in range(1, 13)] + ['2025-01', '2025-02']
+    labels = {'state': ['A', 'B', 'C'], 'sector': ['Rural', 'Urban'],
+              'item': list(catalogue.item_codes), 'month': months}
+    store = PriceTensorStore.write(tmp_path / 'panel', prices, labels, dtype=np.float64)
+    
+    state_weights = {'C': rng.uniform(0, 1, catalogue.n_items)}
+    core = engine.get_distribution_core([0.0, 0.15], store=store, state_weights=state_weights)
+    core = core.set_index(['Measure', 'State', 'Sector', 'Month'])['Value']
+    
+    for state, sector, month in [('A', 'Urban', '2024-05'), ('C', 'Rural', '2025-02')]:
+        s, r, t = labels['state'].index(state), labels['sector'].index(sector), months.index(month)
+        changes = (prices[s, r, :, t] / prices[s, r, :, t - 1] - 1) * 100
+        weights = state_weights.get(state, catalogue.item_weights)
+        for trim in (0.0, 0.15):
+            expected, median = _naive_trimmed_mean(changes, weights, trim)
+            assert abs(core[(f'Trimmed Mean {trim * 100:g}%', state, sector, month)] - expected) < 1e-9
+        assert abs(core[('Weighted Median', state, sector, month)] - median) < 1e-12
+    
+    # YoY needs the same month a year earlier, which only exists for 2025
+    yoy = engine.get_distribution_core(basis='YoY', store=store)
+    assert sorted(yoy['Month'].unique()) == ['2025-01', '2025-02']
+
+def test_node_indices_from_sparse_incidence(tmp_path):
+    """Every node's index equals the Laspeyres index of its items"""
+    engine = _engine_with_prices()
+    catalogue = engine.catalogue
+    assert catalogue.node_incidence.nnz == (catalogue.item_node_ids >= 0).sum()
+    
+    nodes = engine.get_node_indices().set_index(['Level', 'Code', 'Month'])['Index'].sort_index()
+    for level, code in [('division', '1.0'), ('group', '4.5'), ('class', '01.1.1')]:
+        mask = catalogue.nodes_mask([catalogue.node_ids[(level, code)]])
+        expected = engine._calculate_laspeyres(list(catalogue.item_codes[mask]), code)
+        assert np.allclose(nodes[(level, code)].to_numpy(), expected.index)
+    
+    prices = engine.snapshot.values[np.newaxis, np.newaxis] * np.array([1.0, 1.2]).reshape(1, 2, 1, 1)
+    labels = {'state': ['All India'], 'sector': ['Rural', 'Urban'],
+              'item': list(catalogue.item_codes), 'month': engine.months}
+    store = PriceTensorStore.write(tmp_path / 'panel', prices, labels, dtype=np.float64)
+    panel = engine.get_node_indices(levels=['division'], store=store)
+    assert set(panel['Level']) == {'division'}
+    urban = panel[panel['Sector'] == 'Urban'].set_index(['Code', 'Month'])['Index'].sort_index()
+    assert np.allclose(urban['1.0'].to_numpy(), 1.2 * nodes[('division', '1.0')].to_numpy())
+
+def test_reconcile_published_aggregates():
+    """Published item indices re-aggregate to the published division/group/class series"""
+    root = Path(__file__).parent
+    engine = CPIEngine(root / 'weights_new')
+    catalogue = engine.catalogue
+    assert list(catalogue.nodes_for_published_codes(['01', '01.1', '10.1', '01.1.1', '*', 'x'])) == [
+        catalogue.node_ids[('division', '1.0')], catalogue.node_ids[('group', '1.1')],
+        catalogue.node_ids[('group', '10.1')], catalogue.node_ids[('class', '01.1.1')], -1, -1
+    ]
+    
+    published = pd.read_csv(root / 'analysis' / 'scraped_cpi.csv', dtype={'code': str})
+    report = engine.reconcile_published(published)
+    
+    aggregates = published[~published['code'].isin(catalogue.item_ids)]
+    assert len(report) == len(aggregates)
+    assert set(report['Level']) == {'general', 'division', 'group', 'class', 'subclass'}
+    assert report['Abs_Deviation'].dropna().is_monotonic_decreasing
+    assert report['Abs_Deviation'].median() < 0.01
+    assert report['Within_Tolerance'].mean() > 0.95
+    
+    # Scaling every item index scales every recomputed aggregate by the same factor
+    scaled = published.assign(index=np.where(published['code'].isin(catalogue.item_ids),
+                                             published['index'] * 2, published['index']))
+    doubled = engine.reconcile_published(scaled)['Recomputed'].dropna()
+    assert np.allclose(np.sort(doubled), np.sort(2 * report['Recomputed'].dropna()))
+
+def test_contributions_add_up_to_index_change():
+    """Item and node contributions sum to the variant's MoM/YoY change"""
+    engine = _engine_with_prices()
+    core = engine.get_index_with_exclusions(excluded_divisions=['1.0'])
+    
+    items = engine.contributions('item', 'yoy', excluded_divisions=['1.0'])
+    totals = items.groupby('Month')['Contribution_pp'].sum()
+    yoy = pd.Series(core.measure('YoY_Change_%'), index=core.months).dropna()
+    assert np.allclose(totals[yoy.index], yoy)
+    
+    groups = engine.contributions('group', 'mom', excluded_divisions=['1.0'])
+    assert np.allclose(groups.groupby('Month')['Contribution_pp'].sum(), core.mom[1:])
+    assert (groups.loc[groups['Code'].isin(['1.1', '1.2', '1.3']), 'Contribution_pp'] == 0).all()
+    
+    top = engine.contributions('item', 'yoy', top_k=5)
+    full = engine.contributions('item', 'yoy')
+    for month, expected in full.groupby('Month'):
+        picked = top[top['Month'] == month]
+        assert list(picked['Rank']) == [1, 2, 3, 4, 5]
+        assert np.allclose(picked['Contribution_pp'], expected['Contribution_pp'].nlargest(5))
+    bottom = engine.contributions('class', 'yoy', top_k=3, largest=False)
+    assert bottom.groupby('Month')['Contribution_pp'].is_monotonic_increasing.all()
+
+def test_manual_exclusions_batch_matches_single_calls():
+    """Array batch reproduces the single-period method and its validation"""
+    engine = CPIEngine(Path(__file__).parent / 'weights_new')
+    rng = np.random.default_rng(2)
+    headline = 100 + np.cumsum(rng.normal(0.3, 0.2, size=(4, 15)), axis=-1)
+    excluded = 100 + np.cumsum(rng.normal(0.5, 1.0, size=(4, 2, 15)), axis=-1)
+    weights = np.array([[36.75], [6.0]])
+    months = [f'2024-{m:02d}' for m in range(1, 13)] + ['2025-01', '2025-02', '2025-04']
+    
+    batch = engine.calculate_core_with_manual_exclusions_batch(headline, 100.0, excluded, weights, months=months)
+    assert batch['success'] and batch['core_index'].shape == (4, 15)
+    
+    for state, new in [(0, 12), (3, 13)]:
+        single = engine.calculate_core_with_manual_exclusions(
+            headline[state, new - 12], 100.0, headline[state, new], 100.0,
+            [{'name': name, 'old_index': excluded[state, n, new - 12], 'old_weight': weights[n, 0],
+              'new_index': excluded[state, n, new], 'new_weight': weights[n, 0]}
+             for n, name in enumerate(['Food', 'Fuel'])]
+        )
+        assert abs(batch['core_index'][state, new] - single['new_index']) < 1e-9
+        assert abs(batch['inflation_rate'][state, new] - single['inflation_rate']) < 1e-9
+        assert abs(batch['difference_from_headline'][state, new] - single['difference_from_headline']) < 1e-9
+    
+    # The lag is by calendar: 2025-04 pairs with 2024-04, not with position 2
+    assert np.isnan(batch['inflation_rate'][:, :12]).all()
+    expected = (batch['core_index'][:, 14] / batch['core_index'][:, 3] - 1) * 100
+    assert np.allclose(batch['inflation_rate'][:, 14], expected)
+    
+    headline[1, 5] = -1.0
+    failing = engine.calculate_core_with_manual_exclusions_batch(headline, 100.0, excluded, weights)
+    assert not failing['success'] and not failing['valid'][1, 5]
+    assert np.isnan(failing['core_index'][1, 5]) and np.isfinite(failing['core_index'][1, 6])
+    assert any('must be positive (1 of 60 periods)' in error for error in failing['errors'])
+    
+    # A NaN exclusion weight fails its period instead of being skipped
+    holed = np.broadcast_to(weights, excluded.shape[1:]).copy()
+    holed[1, 4] = np.nan
+    failing = engine.calculate_core_with_manual_exclusions_batch(headline, 100.0, excluded, holed)
+    assert not failing['valid'][:, 4].any() and np.isnan(failing['core_index'][:, 4]).all()
+    assert any('Invalid values for exclusions (4 of 60 periods)' in error for error in failing['errors'])
+
+def test_custom_index_series_matches_single_blend():
+    """Series blends reproduce calculate_custom_index month by month"""
+    engine = CPIEngine(Path(__file__).parent / 'weights_new')
+    rng = np.random.default_rng(3)
+    months = pd.Index([f'2025-{m:02d}' for m in range(1, 13)], name='Month')
+    series = pd.DataFrame(100 + rng.normal(0, 3, size=(12, 3)), index=months, columns=['Urban', 'Rural', 'Food'])
+    
+    blends = {
+        '60/40': [{'name': 'Urban', 'weight': 60}, {'name': 'Rural', 'weight': 40}],
+        'Unbalanced': [{'name': 'Urban', 'weight': '30'}, {'name': 'Food', 'weight': 20}],
+        'Bad': [{'name': 'Urban', 'weight': -5}],
+        'Unknown': [{'name': 'Fuel', 'weight': 10}],
+    }
+    result = engine.calculate_custom_index_series(series, blends)
+    blended = result['weighted_average']
+    assert list(blended.columns) == list(blends) and blended.index.equals(months)
+    assert list(result['weight_imbalance']) == [False, True, True, True]
+    assert blended['Bad'].isna().all() and blended['Unknown'].isna().all()
+    assert len(result['errors']) == 2 and not result['success']
+    
+    for name in ['60/40', 'Unbalanced']:
+        single = engine.calculate_custom_index([
+            {**entry, 'value': series.loc['2025-07', entry['name']]} for entry in blends[name]
+        ])
+        assert abs(blended.loc['2025-07', name] - single['weighted_average']) < 1e-9
+    
+    # Thousands of specs over a states x months panel in one call
+    panel = {name: 100 + rng.normal(0, 3, size=(36, 12)) for name in ['Urban', 'Rural']}
+    panel['Rural'][0, 0] = 0.0
+    shares = rng.uniform(0, 100, 2000)
+    many = {f'blend {i}': [{'name': 'Urban', 'weight': w}, {'name': 'Rural', 'weight': 100 - w}]
+            for i, w in enumerate(shares)}
+    result = engine.calculate_custom_index_series(panel, many)
+    assert result['weighted_average'].shape == (2000, 36, 12)
+    expected = (shares[:, None, None] * panel['Urban'] + (100 - shares[:, None, None]) * panel['Rural']) / 100
+    assert np.isnan(result['weighted_average'][:, 0, 0]).all()
+    assert np.allclose(result['weighted_average'][:, 1:], expected[:, 1:])
+    
+    # A hole in a component no blend uses is not an error
+    series['Unused'] = np.nan
+    result = engine.calculate_custom_index_series(series, {'60/40': blends['60/40']})
+    assert result['success'] and not result['errors']
+    assert result['weighted_average']['60/40'].notna().all()
+
+def test_back_series_linking_matches_workbook(tmp_path):
+    """Annual-average linking reproduces the published factor and linked series"""
+    source = tmp_path / 'back_series.xlsx'
+    shutil.copy(Path(__file__).parent / 'Files' / 'Back series data for CPI 2024.xlsx', source)
+    linker = BackSeriesLinker.from_workbook(source)
+    assert all(path.exists() for path in cache_paths(source, 'back_series'))
+    cached = BackSeriesLinker.from_workbook(source)
+    assert cached.months == linker.months and np.array_equal(cached.values, linker.values, equal_nan=True)
+    assert len(linker.months) == 156 and linker.values.shape == (3, 156)
+    
+    new = published_series(pd.read_csv(Path(__file__).parent / 'analysis' / 'scraped_cpi.csv'))
+    factors = linker.linking_factors(new)
+    assert len(factors) == 1 and factors.loc[0, 'State'] == 'All India'
+    assert abs(factors.loc[0, 'Factor'] - 0.526725) < 1e-6
+    assert abs(linker.linking_factors(new, method='overlap', overlap='2025-12').loc[0, 'Factor'] - 104.10 / 198.0) < 1e-12
+    
+    linked = linker.link(new, decimals=4)
+    assert linked is not linker.link(new, decimals=4) and len(linker._linked) == 1
+    assert list(linked['Month'][:2]) == ['2013-01', '2013-02'] and linked['Month'].iloc[-1] == '2026-01'
+    assert abs(linked['Index'].iloc[0] - 55.09282) < 1e-9
+    assert (linked['Source'] == 'current').sum() == 13
+    
+    rebased = linker.rebase(linked, '2025')
+    assert abs(rebased.loc[rebased['Month'].str.startswith('2025'), 'Index'].mean() - 100) < 1e-9
+
+def test_snapshots_isolate_concurrent_reloads():
+    """Calculations run on one immutable snapshot while other threads reload prices"""
+    engine = _engine_with_prices()
+    full = engine.snapshot
+    trimmed = full.prices_df.drop(columns=[full.months[-1]])
+    expected = {len(full.months): engine.get_headline_index().index}
+    engine.load_price_frame(trimmed)
+    expected[len(full.months) - 1] = engine.get_headline_index().index
+    
+    assert engine.snapshot.version > full.version and len(full.months) == len(engine.months) + 1
+    assert not full.values.flags.writeable and not full.node_sums['weighted_sum'].flags.writeable
+    with pytest.raises(Exception, match='read-only'):
+        full.months = []
+    
+    def reload():
+        for _ in range(20):
+            engine.load_price_frame(full.prices_df, full.months)
+            engine.load_price_frame(trimmed)
+    
+    def calculate():
+        results = [engine.get_headline_index() for _ in range(200)]
+        return all(np.array_equal(result.index, expected[len(result.months)]) for result in results)
+    
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        writer = pool.submit(reload)
+        readers = [pool.submit(calculate) for _ in range(3)]
+        writer.result()
+        assert all(reader.result() for reader in readers)
+    
+    # Appending past a snapshot's columns leaves that snapshot untouched
+    before = engine.snapshot
+    engine.append_month(full.months[-1], full.prices_df.set_index('Item_Code')[full.months[-1]].to_dict())
+    assert before.values.shape[1] == len(before.months) == len(full.months) - 1
+    assert np.allclose(engine.get_headline_index().index, expected[len(full.months)], rtol=0, atol=1e-9)
+
+def test_weight_uncertainty_bands():
+    """Monte Carlo weight draws give ordered bands around the published-weight index"""
+    engine = _engine_with_prices()
+    scenarios = {'Headline': {}, 'Ex Food': {'excluded_divisions': ['1.0']}}
+    bands = engine.simulate_weight_uncertainty(scenarios, draws=300, chunk_size=64, seed=7)
+    assert set(bands['Measure']) == {'Index', 'MoM_Change_%', 'YoY_Change_%'}
+    assert len(bands[bands['Measure'] == 'Index']) == 2 * len(engine.months)
+    
+    index = bands[(bands['Variant'] == 'Headline') & (bands['Measure'] == 'Index')]
+    assert np.allclose(index['Point'], engine.get_headline_index().index)
+    assert (index['P5'] <= index['P50']).all() and (index['P50'] <= index['P95']).all()
+    assert ((index['P5'] <= index['Point']) & (index['Point'] <= index['P95'])).all()
+    assert (bands.loc[bands['Measure'] == 'YoY_Change_%', 'Std'] > 0).all()
+    
+    again = engine.simulate_weight_uncertainty(scenarios, draws=300, chunk_size=64, seed=7)
+    assert np.array_equal(again['P95'], bands['P95'])
+    tight = engine.simulate_weight_uncertainty(draws=50, method='bootstrap', effective_size=1e9, seed=7)
+    tight_index = tight.loc[tight['Measure'] == 'Index', 'Std'].to_numpy()
+    assert (tight_index < 0.01 * index['Std'].to_numpy()).all()
+
+def test_exclusion_optimizer_frontier():
+    """Beam search respects the budget and scores match the scenario batch"""
+    engine = _engine_with_prices()
+    frontier = engine.optimize_exclusions(max_excluded_weight=20, beam_width=3, max_exclusions=4)
+    assert frontier['Excluded_Weight'].max() <= 20 + 1e-9 and frontier['Size'].max() <= 4
+    assert list(frontier['Rank']) == list(range(1, len(frontier) + 1)) and frontier['Score'].is_monotonic_increasing
+    assert frontier.loc[frontier['Size'] == 0, 'Frontier'].all()
+    
+    best = frontier.iloc[0]
+    batch = engine.get_scenario_batch({'best': best['Scenario'], 'headline': {}})
+    assert abs(np.nanvar(batch.mom[0, 1:]) - best['Score']) < 1e-12
+    assert abs(batch.total_weight[0] - (100 - best['Excluded_Weight'])) < 1e-6
+    assert best['Score'] < frontier.loc[frontier['Size'] == 0, 'Score'].iloc[0]
+    
+    # Greedy's first pick is the best single class by brute force
+    greedy = engine.optimize_exclusions(levels=['class'], max_excluded_weight=20, beam_width=1, max_exclusions=1)
+    classes = [code for level, code in engine.catalogue.node_keys if level == 'class']
+    singles = engine.get_scenario_batch({code: {'excluded_classes': [code]} for code in classes})
+    eligible = singles.excluded_weight <= 20
+    scores = np.where(eligible, np.nanvar(singles.mom[:, 1:], axis=1), np.inf)
+    assert greedy.loc[greedy['Size'] == 1, 'Codes'].iloc[0] == [classes[int(np.argmin(scores))]]
+    
+    tracking = engine.optimize_exclusions(objective='tracking', beam_width=2, max_exclusions=2)
+    assert tracking['Score'].iloc[0] <= tracking.loc[tracking['Size'] == 0, 'Score'].iloc[0]
+
+def test_imputation_fixes_the_basket(tmp_path, monkeypatch):
+    """Parent-node, carry-forward and donor imputation fill the price holes"""
+    engine = _engine_with_prices()
+    catalogue = engine.catalogue
+    months = engine.months
+    prices = engine.prices_df.copy()
+    gap_item, late_item = catalogue.item_codes[5], catalogue.item_codes[7]
+    prices.loc[prices['Item_Code'] == gap_item, months[3:6]] = np.nan
+    prices.loc[prices['Item_Code'] == late_item, months[:2]] = np.nan
+    engine.load_price_frame(prices)
+    
+    carried = engine.impute_missing(['carry_forward'], apply=False)
+    assert np.all(carried['values'][5, 3:6] == carried['values'][5, 2])
+    
+    result = engine.impute_missing(['parent', 'carry_forward'])
+    counts = result['counts'].groupby('Method')['Cells'].sum()
+    assert counts['parent'] == 3 and counts['carry_forward'] == 0 and counts['missing'] == 2
+    assert list(result['imputed'][5, 2:7]) == [0, 2, 2, 2, 0]
+    
+    # First imputed month moves with the rest of the item's subclass
+    values, priced = engine.snapshot.values, engine.snapshot.available > 0
+    siblings = catalogue.nodes_mask([catalogue.item_node_ids[3][5]])
+    siblings[5] = False
+    weights = catalogue.item_weights * siblings
+    change = (weights @ values[:, 3]) / (weights @ values[:, 2])
+    assert abs(values[5, 3] - values[5, 2] * change) < 1e-9 and priced[5, 3:6].all()
+    assert not priced[7, :2].any()
+    assert engine.prices_df.set_index('Item_Code').loc[gap_item, months[4]] == values[5, 4]
+    
+    base = np.where(priced, values, np.nan)[np.newaxis, np.newaxis] * np.array([1.0, 1.2]).reshape(1, 2, 1, 1)
+    panel = np.stack([base[0], base[0] * 1.1])
+    panel[1, 0, 9, 4] = np.nan
+    labels = {'state': ['Bihar', 'Kerala'], 'sector': ['Rural', 'Urban'],
+              'item': list(catalogue.item_codes), 'month': months}
+    store = PriceTensorStore.write(tmp_path / 'panel', panel, labels, dtype=np.float64)
+    donated = engine.impute_missing(['donor', 'parent'], store=store)
+    assert donated['values'].shape == panel.shape and donated['imputed'][1, 0, 9, 4] == 1
+    assert donated['values'][1, 0, 9, 4] == panel[0, 0, 9, 4]
+    assert not donated['available'][:, :, 7, :2].any()
+    
+    # An append started while imputing waits for the imputed snapshot, not the other way round
+    appender = threading.Thread(target=engine.append_month, args=('2099-01', {gap_item: 1.0}))
+    
+    def impute_while_appending(*args):
+        appender.start()
+        appender.join(timeout=0.2)
+        return impute_prices(*args)
+    
+    impute_prices = cpi_engine.impute_prices
+    monkeypatch.setattr(cpi_engine, 'impute_prices', impute_while_appending)
+    engine.impute_missing(['parent'])
+    appender.join()
+    assert engine.months == months + ['2099-01']
+
+def test_item_and_subclass_exclusions_use_sparse_masks():
+    """Item, subclass, carve-out and include-only baskets match direct item calculations"""
+    engine = _engine_with_prices()
+    catalogue = engine.catalogue
+    codes = np.asarray(catalogue.item_codes)
+    
+    def assert_matches(result, basket):
+        expected = engine._calculate_laspeyres(list(codes[basket]), 'direct')
+        assert result['Items_Count'] == int(basket.sum())
+        assert abs(result['Total_Weight'] - expected['Total_Weight']) < 1e-9
+        for got, want in zip(result['Monthly_Data'], expected['Monthly_Data']):
+            assert abs(got['Index'] - want['Index']) < 1e-8
+    
+    scattered = codes[::7][:40]
+    without_items = engine.get_index_with_exclusions(excluded_items=list(scattered))
+    assert_matches(without_items, ~np.isin(codes, scattered))
+    assert without_items['excluded_items_count'] == 40
+    
+    subclass = catalogue.node_keys[catalogue.item_node_ids[3][0]][1]
+    assert_matches(engine.get_index_with_exclusions(excluded_subclasses=[subclass]),
+                   ~catalogue.nodes_mask([catalogue.item_node_ids[3][0]]))
+    
+    # Exclude food but keep cereals
+    food = catalogue.nodes_mask(catalogue.nodes_for_codes(divisions=['1.0']))
+    cereals = catalogue.nodes_mask(catalogue.nodes_for_codes(classes=['01.1.1']))
+    carve_out = engine.get_index_with_exclusions(excluded_divisions=['1.0'], included={'class': ['01.1.1']})
+    assert_matches(carve_out, ~food | cereals)
+    
+    only = engine.get_index_with_exclusions(include_only={'division': ['1.0'], 'item': list(scattered[-3:])},
+                                            excluded_items=[codes[0]])
+    assert_matches(only, (food | np.isin(codes, scattered[-3:])) & (codes != codes[0]))
+    
+    scenarios = {
+        'items': {'excluded_items': list(scattered)},
+        'carve_out': {'excluded_divisions': ['1.0'], 'included': {'class': ['01.1.1']}},
+        'food_only': {'include_only': {'division': ['1.0']}},
+    }
+    batch = engine.get_scenario_batch(scenarios)
+    for name, selection in scenarios.items():
+        single = engine.get_index_with_exclusions(**selection)
+        assert np.allclose(batch[name].index, [row['Index'] for row in single['Monthly_Data']], atol=1e-8)
+        assert abs(batch.excluded_weight[list(scenarios).index(name)] - single['excluded_weight']) < 1e-9
+    
+    # Cover parts are disjoint and add back up to the mask
+    mask = ~food | cereals
+    node_ids, item_ids = catalogue.mask_cover(mask)
+    parts = np.asarray(catalogue.node_membership[node_ids].sum(axis=0)).ravel() + np.bincount(item_ids, minlength=catalogue.n_items)
+    assert parts.max() == 1 and ((parts == 1) == mask).all()
+
 if __name__ == "__main__":
     engine = test_engine()
     